@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""Check how long ``import termtool`` takes against a time budget.
+
+The import is timed in fresh interpreters with ``python -X importtime``, and
+the best of several runs is compared to the budget. The check also fails if
+importing termtool imports the optional table and progress bar libraries,
+which should only be imported when a tool uses them.
+
+Run from the top of the source tree::
+
+    $ python benchmarks/bench_import.py --budget-ms 50
+
+The exit code is ``1`` if the import is over budget.
+
+The startup scenarios for `run.py` are registered here too.
+
+"""
+
+import argparse
+import os.path
+import subprocess
+import sys
+
+from harness import scenario
+
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+DEFERRED_MODULES = ('prettytable', 'progressbar')
+"""Modules that importing termtool should not import."""
+
+
+def time_import():
+    """Import termtool in a new interpreter, returning the cumulative import
+    time in milliseconds and the names of all the modules imported."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SOURCE_DIR, env.get('PYTHONPATH')]))
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import termtool'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, universal_newlines=True)
+    _, output = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError('importing termtool failed:\n%s' % output)
+
+    cumulative, modules = None, set()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        modules.add(name)
+        if name == 'termtool':
+            cumulative = int(cumulative_us) / 1000.0
+    return cumulative, modules
+
+
+def register_startup_scenario(name, code):
+    @scenario('startup/%s' % name)
+    def startup_scenario():
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [SOURCE_DIR, env.get('PYTHONPATH')]))
+        command = [sys.executable, '-c', code]
+        return lambda: subprocess.check_call(command, env=env)
+
+
+register_startup_scenario('python', 'pass')
+register_startup_scenario('import termtool', 'import termtool')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget-ms', type=float, default=50.0, help='the most milliseconds the import may take (default: %(default)s)')
+    parser.add_argument('--runs', type=int, default=7, help='the number of imports to time (default: %(default)s)')
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        cumulative, modules = time_import()
+        timings.append(cumulative)
+
+    best = min(timings)
+    print('import termtool: best %.1f ms, worst %.1f ms over %d runs (budget %.1f ms)'
+        % (best, max(timings), args.runs, args.budget_ms))
+
+    failed = False
+    deferred = sorted(modules.intersection(DEFERRED_MODULES))
+    if deferred:
+        print('FAIL: import termtool also imported %s' % ', '.join(deferred))
+        failed = True
+    if best > args.budget_ms:
+        print('FAIL: import termtool is over budget by %.1f ms' % (best - args.budget_ms))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
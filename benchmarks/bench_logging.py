@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""Compare the throughput of termtool's log formatters with the original
+ones, which set color attributes on every record and always ran the color
+stripping regular expression.
+
+Run from the top of the source tree::
+
+    $ python benchmarks/bench_logging.py
+
+The log formatting scenarios for `run.py` are registered here too.
+
+"""
+
+import logging
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from termtool import Termtool, _STRIP_COLOR
+from harness import scenario
+
+
+class OriginalNoColorLogFormatter(logging.Formatter):
+
+    def format(self, record):
+        record.levelcolor = ''
+        record.resetcolor = ''
+        logline = super(OriginalNoColorLogFormatter, self).format(record)
+        return _STRIP_COLOR.sub('', logline)
+
+
+class OriginalColorLogFormatter(logging.Formatter):
+
+    color_for_level = Termtool._ColorLogFormatter.color_for_level
+
+    def format(self, record):
+        color = self.color_for_level.get(record.levelno)
+        if color is not None:
+            record.levelcolor = '\033[1;%sm' % color
+        record.resetcolor = '\033[0m'
+        return super(OriginalColorLogFormatter, self).format(record)
+
+
+FORMATTERS = (
+    ('original color', OriginalColorLogFormatter),
+    ('color', Termtool._ColorLogFormatter),
+    ('original no color', OriginalNoColorLogFormatter),
+    ('no color', Termtool._NoColorLogFormatter),
+    ('json', Termtool._JSONLogFormatter),
+)
+
+MESSAGES = (
+    ('plain', 'processed item %d'),
+    ('escaped', 'processed \033[1mbold\033[0m item %d'),
+)
+
+
+def make_records(message, count=100):
+    levels = (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR)
+    return [logging.LogRecord('bench', levels[i % len(levels)], __file__, 1, message, (i,), None)
+        for i in range(count)]
+
+
+def register_formatter_scenario(name, formatter_class, message_name, message):
+    @scenario('log format/%s/%s' % (name, message_name))
+    def formatter_scenario():
+        formatter = formatter_class(Termtool.log_format)
+        records = make_records(message)
+        def format_records():
+            for record in records:
+                formatter.format(record)
+        return format_records
+
+
+for name, formatter_class in FORMATTERS:
+    for message_name, message in MESSAGES:
+        register_formatter_scenario(name, formatter_class, message_name, message)
+
+
+def main():
+    print('%-20s %-10s %14s' % ('formatter', 'message', 'records/s'))
+    for name, formatter_class in FORMATTERS:
+        for message_name, message in MESSAGES:
+            formatter = formatter_class(Termtool.log_format)
+            records = make_records(message, count=10000)
+            def format_records():
+                for record in records:
+                    formatter.format(record)
+            best = min(timeit.repeat(format_records, number=1, repeat=5))
+            print('%-20s %-10s %14.0f' % (name, message_name, len(records) / best))
+
+
+if __name__ == '__main__':
+    main()
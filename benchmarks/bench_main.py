@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""Scenarios for running `Termtool.main()` end to end, with and without a
+config file, for running many commands one by one or as a ``--batch``, and
+for a subcommand checkpointing every item of its work.
+
+These are run by `run.py`.
+
+"""
+
+import logging
+import os
+import os.path
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_parser import make_tool
+from harness import environ, scenario
+from termtool import Termtool, subcommand
+
+
+def register_main_scenario(num_commands, with_config):
+    name = 'main/%d commands/%s config file' % (num_commands, 'with' if with_config else 'no')
+
+    @scenario(name)
+    def main_scenario():
+        tool = make_tool(num_commands)()
+        with tempfile.TemporaryDirectory() as home, environ(HOME=home):
+            if with_config:
+                with open(os.path.join(home, '.%s' % type(tool).__name__.lower()), 'w') as config_file:
+                    config_file.write('-q\n--no-color\n')
+
+            root_logger = logging.getLogger()
+            argv = ['command0000', '--option-0', 'x', 'target']
+            def run_main():
+                tool.main(argv)
+                # Don't pile up log handlers over many runs.
+                del root_logger.handlers[:]
+            yield run_main
+
+
+for num_commands in (1, 50):
+    for with_config in (False, True):
+        register_main_scenario(num_commands, with_config)
+
+
+def register_batch_scenario(num_commands, num_lines, batch):
+    name = 'main/%d commands/%d runs %s' % (num_commands, num_lines, 'in a batch' if batch else 'one by one')
+
+    @scenario(name)
+    def batch_scenario():
+        tool = make_tool(num_commands)()
+        root_logger = logging.getLogger()
+        argv = ['command0000', '--option-0', 'x', 'target']
+
+        # Keep the batch's status lines out of the results.
+        with tempfile.TemporaryDirectory() as home, environ(HOME=home), open(os.devnull, 'w') as devnull:
+            batch_path = os.path.join(home, 'batch')
+            with open(batch_path, 'w') as batch_file:
+                batch_file.write('%s\n' % ' '.join(argv) * num_lines)
+
+            def run_batch():
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    tool.main(['--batch', batch_path])
+                finally:
+                    sys.stdout = stdout
+                del root_logger.handlers[:]
+
+            def run_one_by_one():
+                for _ in range(num_lines):
+                    tool.main(argv)
+                    del root_logger.handlers[:]
+
+            yield run_batch if batch else run_one_by_one
+
+
+for batch in (False, True):
+    register_batch_scenario(50, 100, batch)
+
+
+CHECKPOINT_ITEMS = 10000
+
+
+class Checkpointer(Termtool):
+
+    @subcommand()
+    def work(self, args):
+        for item in range(CHECKPOINT_ITEMS):
+            if self.checkpoint_items:
+                self.checkpoint('done', item + 1)
+
+
+def register_checkpoint_scenario(checkpoint):
+    name = 'main/%d items/%s checkpoints' % (CHECKPOINT_ITEMS, 'with' if checkpoint else 'no')
+
+    @scenario(name)
+    def checkpoint_scenario():
+        tool = Checkpointer()
+        tool.checkpoint_items = checkpoint
+        root_logger = logging.getLogger()
+        with tempfile.TemporaryDirectory() as home, environ(HOME=home, XDG_STATE_HOME=home):
+            def run_main():
+                tool.main(['work'])
+                del root_logger.handlers[:]
+            yield run_main
+
+
+for checkpoint in (False, True):
+    register_checkpoint_scenario(checkpoint)
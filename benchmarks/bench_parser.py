@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Compare building eager and lazy argument parsers for big tools.
+
+Run from the top of the source tree::
+
+    $ python benchmarks/bench_parser.py
+
+The ``build_arg_parser`` scenarios for `run.py` are registered here too.
+
+"""
+
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from termtool import Termtool, subcommand, argument
+from harness import scenario
+
+
+def make_tool(num_commands, num_arguments=3, lazy=False):
+    """Make a `Termtool` subclass with `num_commands` subcommands, each with
+    `num_arguments` arguments."""
+    attrs = {'lazy_arg_parser': lazy}
+    for i in range(num_commands):
+        def command(self, args):
+            pass
+        for j in range(num_arguments):
+            command = argument('--option-%d' % j, help='option number %d' % j)(command)
+        command = argument('target', help='the thing to act on')(command)
+        command.__doc__ = 'Do thing number %d.' % i
+        name = 'command%04d' % i
+        attrs[name] = subcommand(name, help='do thing number %d' % i)(command)
+    return type(Termtool)('Tool%d' % num_commands, (Termtool,), attrs)
+
+
+def register_build_scenario(num_commands, num_arguments, lazy):
+    mode = 'lazy' if lazy else 'eager'
+    name = 'build_arg_parser/%s/%d commands x %d arguments' % (mode, num_commands, num_arguments)
+
+    @scenario(name)
+    def build_scenario():
+        tool = make_tool(num_commands, num_arguments, lazy=lazy)()
+        argv = ['-v', 'command0000', 'target']
+        return lambda: tool.build_arg_parser(argv).parse_args(argv)
+
+
+for num_commands in (1, 50, 500):
+    for num_arguments in (0, 5):
+        for lazy in (False, True):
+            register_build_scenario(num_commands, num_arguments, lazy)
+
+
+def main():
+    modes = (('eager', False), ('lazy', True))
+    argv = ['-v', 'command0000', '--option-0', 'x', 'target']
+    print('%-12s' % 'subcommands' + ''.join('%16s' % ('%s (ms)' % mode) for mode, _ in modes))
+    for num_commands in (10, 100, 1000):
+        results = []
+        for mode, lazy in modes:
+            tool = make_tool(num_commands, lazy=lazy)()
+            def build():
+                tool.build_arg_parser(argv).parse_args(argv)
+            number = max(1, 2000 // num_commands)
+            best = min(timeit.repeat(build, number=number, repeat=5)) / number
+            results.append(best * 1000)
+        print('%-12d' % num_commands + ''.join('%16.3f' % result for result in results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""Compare the throughput of a filter subcommand using `Termtool.records()`
+and `Termtool.emit()` with one reading and printing line by line, in
+megabytes of input per second.
+
+Run from the top of the source tree::
+
+    $ python benchmarks/bench_stream.py
+
+The stream scenarios for `run.py` are registered here too.
+
+"""
+
+import gzip
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from termtool import Termtool
+from harness import scenario
+
+
+def make_input(dirpath, num_lines, compressed=False):
+    """Write a file of `num_lines` records in the directory `dirpath`,
+    returning its path."""
+    filepath = os.path.join(dirpath, 'records.txt')
+    with open(filepath, 'w') as input_file:
+        for i in range(num_lines):
+            input_file.write('record %d\tsome payload for the record\t%d\n' % (i, i * 7))
+    if compressed:
+        with open(filepath, 'rb') as input_file:
+            with gzip.open(filepath + '.gz', 'wb') as gzip_file:
+                shutil.copyfileobj(input_file, gzip_file)
+        filepath += '.gz'
+    return filepath
+
+
+def print_filter(filepath, out):
+    """Upper case the lines of `filepath` the way filters did by hand."""
+    with open(filepath, 'r') as input_file:
+        for line in input_file:
+            out.write(line.rstrip('\n').upper())
+            out.write('\n')
+
+
+def stream_filter(filepath, out):
+    """Upper case the lines of `filepath` with `records()` and `emit()`."""
+    tool = Termtool()
+    stdout, sys.stdout = sys.stdout, out
+    try:
+        for record in tool.records([filepath]):
+            tool.emit(record.upper())
+        tool.flush_records()
+    finally:
+        sys.stdout = stdout
+
+
+FILTERS = (
+    ('print', print_filter, False),
+    ('records/emit', stream_filter, False),
+    ('records/emit gzip', stream_filter, True),
+)
+
+
+def register_stream_scenario(name, filter_fn, compressed):
+    @scenario('stream/%s' % name)
+    def stream_scenario():
+        with tempfile.TemporaryDirectory() as dirpath, open(os.devnull, 'w') as out:
+            filepath = make_input(dirpath, 10000, compressed)
+            def run_filter():
+                filter_fn(filepath, out)
+            yield run_filter
+
+
+for name, filter_fn, compressed in FILTERS:
+    register_stream_scenario(name, filter_fn, compressed)
+
+
+def main():
+    num_lines = 500000
+    print('%-20s %10s' % ('filter', 'MB/s'))
+    with tempfile.TemporaryDirectory() as dirpath, open(os.devnull, 'w') as out:
+        uncompressed_size = os.path.getsize(make_input(dirpath, num_lines))
+        for name, filter_fn, compressed in FILTERS:
+            filepath = make_input(dirpath, num_lines, compressed)
+            best = min(timeit.repeat(lambda: filter_fn(filepath, out), number=1, repeat=5))
+            # Count the uncompressed input, so gzip rates are comparable.
+            print('%-20s %10.1f' % (name, uncompressed_size / best / 1e6))
+
+
+if __name__ == '__main__':
+    main()
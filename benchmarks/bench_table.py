@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""Compare rendering big tables with termtool's tiny table and PrettyTable
+(if installed).
+
+Run from the top of the source tree::
+
+    $ python benchmarks/bench_table.py --rows 10000 --cols 20
+
+The table rendering scenarios for `run.py` are registered here too.
+
+"""
+
+import argparse
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from termtool import _TinyTable
+from harness import scenario
+
+
+def table_classes():
+    classes = [('tiny', _TinyTable)]
+    try:
+        from prettytable import PrettyTable
+    except ImportError:
+        pass
+    else:
+        classes.append(('prettytable', PrettyTable))
+    return classes
+
+
+def make_rows(num_rows, num_cols):
+    # The tiny table only supports strings.
+    return [[str((i * 7919 + j * 104729) % (10 ** (1 + j % 6))) for j in range(num_cols)] for i in range(num_rows)]
+
+
+def register_table_scenario(name, table_class, num_rows, num_cols):
+    @scenario('table/%s/%d x %d' % (name, num_rows, num_cols))
+    def table_scenario():
+        labels = ['column %d' % i for i in range(num_cols)]
+        rows = make_rows(num_rows, num_cols)
+        def build():
+            table = table_class(labels)
+            for row in rows:
+                table.add_row(row)
+            return str(table)
+        return build
+
+
+for name, table_class in table_classes():
+    for num_rows, num_cols in ((100, 5), (1000, 10), (10000, 20)):
+        register_table_scenario(name, table_class, num_rows, num_cols)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000, help='rows per table (default: %(default)s)')
+    parser.add_argument('--cols', type=int, default=20, help='columns per table (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='times to build each table (default: %(default)s)')
+    args = parser.parse_args()
+
+    labels = ['column %d' % i for i in range(args.cols)]
+    rows = make_rows(args.rows, args.cols)
+
+    print('%d x %d table' % (args.rows, args.cols))
+    for name, table_class in table_classes():
+        def build():
+            table = table_class(labels)
+            for row in rows:
+                table.add_row(row)
+            return str(table)
+        best = min(timeit.repeat(build, number=1, repeat=args.repeat))
+        print('%-12s %10.1f ms' % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
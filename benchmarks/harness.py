@@ -0,0 +1,146 @@
+"""A small runner for termtool's benchmark scenarios.
+
+Each ``bench_*.py`` module in this directory registers scenarios with the
+`scenario()` decorator. A scenario function sets up whatever it needs and
+returns a callable taking no arguments, which is what gets timed. Scenarios
+that need to clean up after themselves, such as removing temporary files,
+can instead be generators that yield the callable; they're resumed to clean
+up once it's been timed.
+
+The runner calibrates how many calls make up one sample, takes several
+samples, and reports the median time per call. Results can be saved as JSON
+and compared against a saved baseline; see `run.py`.
+
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import platform
+import sys
+import timeit
+import types
+
+
+SCENARIOS = OrderedDict()
+"""All the registered scenario functions, keyed on scenario name."""
+
+
+def scenario(name):
+    """Register the decorated function as the setup for the scenario `name`."""
+    def _decor(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return _decor
+
+
+@contextmanager
+def environ(**values):
+    """Set the environment variables in `values` for the duration of the
+    ``with`` block, then put back the ones they replaced."""
+    saved = dict((key, os.environ.get(key)) for key in values)
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(fn, samples=10, min_sample_time=0.05):
+    """Time `fn`, returning a list of `samples` times per call in seconds.
+
+    Each sample is enough calls to take at least `min_sample_time` seconds,
+    so quick calls aren't lost in the timer's resolution.
+
+    """
+    timer = timeit.Timer(fn)
+    # Warm up caches and imports before calibrating.
+    fn()
+    loops = 1
+    while True:
+        if timer.timeit(loops) >= min_sample_time:
+            break
+        loops *= 2
+    return [sample / loops for sample in timer.repeat(samples, loops)]
+
+
+def run(names, samples=10, out=sys.stdout):
+    """Run the named scenarios, returning a results dictionary suitable for
+    saving as JSON."""
+    results = OrderedDict()
+    results['metadata'] = {
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+    }
+    results['benchmarks'] = OrderedDict()
+    for name in names:
+        setup = SCENARIOS[name]()
+        if isinstance(setup, types.GeneratorType):
+            fn = next(setup)
+        else:
+            fn = setup
+        try:
+            times = measure(fn, samples=samples)
+        finally:
+            if isinstance(setup, types.GeneratorType):
+                # Let the scenario clean up after itself.
+                setup.close()
+        results['benchmarks'][name] = {'median': median(times), 'min': min(times), 'max': max(times)}
+        out.write('%-50s %12s  (min %s, max %s)\n' % (name, format_time(median(times)),
+            format_time(min(times)), format_time(max(times))))
+        out.flush()
+    return results
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.3f %s' % (seconds / scale, unit)
+    return '%.1f ns' % (seconds / 1e-9)
+
+
+def compare(results, baseline, threshold=0.1, out=sys.stdout):
+    """Compare `results` to `baseline`, returning the names of scenarios
+    whose median time grew by more than `threshold` (a fraction)."""
+    if results['metadata'] != baseline.get('metadata'):
+        out.write('warning: the baseline was run on %(python)s (%(platform)s)\n' % baseline.get('metadata', {}))
+
+    regressions = list()
+    out.write('\n%-50s %12s %12s %8s\n' % ('scenario', 'baseline', 'now', 'change'))
+    for name, result in results['benchmarks'].items():
+        try:
+            before = baseline['benchmarks'][name]['median']
+        except KeyError:
+            continue
+        change = result['median'] / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSED'
+        out.write('%-50s %12s %12s %+7.1f%%%s\n' % (name, format_time(before),
+            format_time(result['median']), change * 100, flag))
+    return regressions
+
+
+def load(filename):
+    with open(filename, 'r') as results_file:
+        return json.load(results_file)
+
+
+def save(results, filename):
+    with open(filename, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+        results_file.write('\n')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Run termtool's benchmark scenarios, optionally comparing them against a
+saved baseline.
+
+Run from the top of the source tree::
+
+    $ python benchmarks/run.py --output baseline.json
+    ... change some code ...
+    $ python benchmarks/run.py --baseline baseline.json
+
+With ``--baseline``, the exit code is ``1`` if any scenario's median time
+grew by more than the ``--threshold``.
+
+``benchmarks/baseline.json`` holds results for the current code, saved with
+``--samples 25``. The machine and Python it was run on are in its
+``metadata``. Times from other machines aren't comparable, so save your own
+baseline before changing the code, and update the saved one along with
+changes that make scenarios faster or slower.
+
+"""
+
+import argparse
+import os.path
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness
+
+# Import the scenario modules so they register their scenarios.
+import bench_import
+import bench_logging
+import bench_main
+import bench_parser
+import bench_stream
+import bench_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('filters', nargs='*', metavar='FILTER', help='run only scenarios with names containing FILTER')
+    parser.add_argument('--list', action='store_true', help='list the scenarios and exit')
+    parser.add_argument('--samples', type=int, default=10, help='samples to take of each scenario (default: %(default)s)')
+    parser.add_argument('--output', metavar='FILE', help='save the results as JSON to FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results to those saved in FILE')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent slowdown from the baseline counted as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    names = [name for name in harness.SCENARIOS
+        if not args.filters or any(pattern in name for pattern in args.filters)]
+    if args.list:
+        for name in names:
+            print(name)
+        return 0
+
+    results = harness.run(names, samples=args.samples)
+    if args.output:
+        harness.save(results, args.output)
+    if args.baseline:
+        regressions = harness.compare(results, harness.load(args.baseline), threshold=args.threshold / 100.0)
+        if regressions:
+            print('\n%d scenario(s) regressed by more than %.0f%%' % (len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
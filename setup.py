@@ -33,6 +33,6 @@ setup(
     ],
 
     packages=[],
-    py_modules=['termtool'],
+    py_modules=['termtool', 'termtool_client'],
     requires=['argparse', 'PrettyTable', 'progressbar'],
 )
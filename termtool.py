@@ -1,14 +1,27 @@
 import argparse
+from collections import OrderedDict
+import errno
 import logging
 import os
 import os.path
 import re
 import sys
+import threading
+import time
 
 
 __version__ = '1.1'
 
 
+_SUBCOMMAND_OPTIONS = {
+    'parallel': None,
+    'pool': 'thread',
+    'ordered': True,
+    'cache_ttl': None,
+}
+"""The termtool settings `subcommand()` accepts, with their default values."""
+
+
 def subcommand(name=None, **kwargs):
     """Decorate an instance method as a tool subcommand.
 
@@ -16,18 +29,107 @@ def subcommand(name=None, **kwargs):
     user to type. To use a different one, specify the `name` argument to the
     `subcommand()` decorator.
 
+    These keyword arguments control how termtool runs the subcommand:
+
+    `parallel`  The `dest` of an argument taking a list of values (such as
+                hosts or IDs). The subcommand is called once for each value,
+                in a pool of workers sized by the ``--jobs`` option, with the
+                argument set to that one value.
+    `pool`      ``'thread'`` (the default) or ``'process'``, the kind of
+                worker pool for `parallel` subcommands.
+    `ordered`   Whether results of a `parallel` subcommand are handled in the
+                order of the values (the default) or as they're completed.
+    `cache_ttl` For subcommands whose output depends only on their
+                arguments, how many seconds to reuse the output of a run
+                with the same arguments, instead of running again.
+
     The remaining keyword arguments are passed to the `add_parser()` method
     declaring the subcommand, so arguments to the `argparse.ArgumentParser`
     constructor are valid.
 
     """
+    options = dict((key, kwargs.pop(key)) for key in list(kwargs) if key in _SUBCOMMAND_OPTIONS)
+
     def _decor(fn):
         """Tag the decorated function with the subcommand settings to use later."""
         fn._subcommand = (name or fn.__name__, kwargs)
+        fn._subcommand_options = options
         return fn
     return _decor
 
 
+def _subcommand_option(command, key):
+    """Return the termtool setting `key` of the subcommand method `command`."""
+    try:
+        return command._subcommand_options[key]
+    except (AttributeError, KeyError):
+        return _SUBCOMMAND_OPTIONS[key]
+
+
+def _is_coroutine_function(fn):
+    """Return whether `fn` was defined with ``async def``.
+
+    This checks the function's code flags directly, so tools with only
+    regular subcommands don't need to import `inspect` or `asyncio`.
+
+    """
+    CO_COROUTINE = 0x80
+    code = getattr(fn, '__code__', None)
+    return bool(code is not None and code.co_flags & CO_COROUTINE)
+
+
+def _call_subcommand(tool, command, args):
+    """Invoke the subcommand method `command` of `tool` with `args`, in a
+    way worker processes can unpickle."""
+    return command(tool, args)
+
+
+def _takes_argv(method):
+    """Return whether the bound `method` takes an argument besides the
+    instance, as `Termtool.build_arg_parser()` takes `argv`."""
+    CO_VARARGS = 0x04
+    code = getattr(getattr(method, '__func__', method), '__code__', None)
+    return code is None or code.co_argcount > 1 or bool(code.co_flags & CO_VARARGS)
+
+
+def _stop_executor(executor, jobs):
+    """Cancel the `jobs` submitted to the `concurrent.futures` `executor` and
+    shut it down without waiting for the jobs already running."""
+    for job in jobs:
+        job.cancel()
+    try:
+        executor.shutdown(wait=False, cancel_futures=True)
+    except TypeError:
+        # Before Python 3.9, cancelling the jobs ourselves has to do.
+        executor.shutdown(wait=False)
+
+
+def _code_names(fn):
+    """Return the set of global and attribute names used by the code of the
+    function `fn`, including its nested functions and comprehensions."""
+    names = set()
+    codes = [getattr(fn, '__code__', None)]
+    while codes:
+        code = codes.pop()
+        if code is None:
+            continue
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if hasattr(const, 'co_names'))
+    return names
+
+
+_SUBCOMMAND_RUN_OPTIONS = ('format', 'jobs', 'concurrency', 'cache', 'resume')
+"""The names of the termtool options subcommands get when they use them."""
+
+
+def _add_termtool_option(parser, *option_strings, **kwargs):
+    """Add one of termtool's own options to `parser`, unless the tool
+    already has an option with any of the same `option_strings`."""
+    if any(option in parser._option_string_actions for option in option_strings):
+        return
+    parser.add_argument(*option_strings, **kwargs)
+
+
 def argument(*args, **kwargs):
     """Declare an argument to the decorated class or instance method.
 
@@ -49,34 +151,1554 @@ def argument(*args, **kwargs):
     return _decor
 
 
+_STRIP_COLOR = re.compile(r'\033\[[^m]+m')
+"""The compiled regular expression to remove ANSI color codes from a string."""
+
+
+class _BatchingLogListener(object):
+
+    """A background thread that takes log records off a queue and writes
+    them to a stream handler, many records at a time."""
+
+    def __init__(self, queue, handler, batch_size=500):
+        self.queue = queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='termtool log writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Write out the records already queued, then stop the thread."""
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        try:
+            from queue import Empty
+        except ImportError:
+            from Queue import Empty
+
+        queue, handler = self.queue, self.handler
+        while True:
+            records = [queue.get()]
+            while records[-1] is not None and len(records) < self.batch_size:
+                try:
+                    records.append(queue.get_nowait())
+                except Empty:
+                    break
+
+            lines = list()
+            for record in records:
+                if record is None or record.levelno < handler.level or not handler.filter(record):
+                    continue
+                try:
+                    lines.append(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+            if lines:
+                handler.acquire()
+                try:
+                    handler.stream.write(''.join(lines))
+                    handler.flush()
+                except Exception as exc:
+                    self._report_write_error(len(lines), exc)
+                finally:
+                    handler.release()
+
+            if records[-1] is None:
+                return
+
+    def _report_write_error(self, count, exc):
+        """Report that `count` log lines couldn't be written because of the
+        exception `exc`, through logging's handler of last resort."""
+        last_resort = getattr(logging, 'lastResort', None)
+        if last_resort is None:
+            return
+        record = logging.LogRecord('termtool', logging.ERROR, __file__, 0,
+            'Could not write %d log lines: %s', (count, exc), None)
+        last_resort.handle(record)
+
+
+_PLAIN_TEXT = re.compile(r'^[\x20-\x7e]*$')
+"""The compiled regular expression matching text whose display width is its
+length."""
+
+
+def _display_width(text):
+    """Return how many terminal columns `text` takes up, not counting ANSI
+    color codes, with wide East Asian characters taking two columns and
+    combining characters none."""
+    if _PLAIN_TEXT.match(text):
+        return len(text)
+    import unicodedata
+    if not isinstance(text, type(u'')):
+        text = text.decode('utf-8', 'replace')
+    if '\033' in text:
+        text = _STRIP_COLOR.sub('', text)
+    width = 0
+    for char in text:
+        if unicodedata.combining(char):
+            continue
+        width += 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+    return width
+
+
 class _TinyTable(object):
 
     def __init__(self, labels):
-        self.rows = [labels]
+        self.rows = list()
+        self.add_row(labels)
+
+    def add_row(self, values):
+        self.rows.append([value if isinstance(value, type('')) else '%s' % (value,) for value in values])
+
+    def __str__(self):
+        rows = self.rows
+        # Tables of plain text are measured by length, as is quickest.
+        if _PLAIN_TEXT.match(''.join(''.join(values) for values in rows)):
+            col_sizes = [max(map(len, column)) for column in zip(*rows)]
+            format_str = '  '.join('{{: <{}}}'.format(size) for size in col_sizes)
+            return '\n'.join(format_str.format(*values) for values in rows)
+
+        cell_widths = [list(map(_display_width, values)) for values in rows]
+        col_sizes = [max(column) for column in zip(*cell_widths)]
+        return '\n'.join('  '.join(value + ' ' * (size - width) for value, width, size in zip(values, widths, col_sizes))
+            for values, widths in zip(rows, cell_widths))
+
+
+class _StreamingTable(object):
+
+    """A table that writes its rows to a file as they're added.
+
+    Column widths are taken from `widths` if given, or else from the labels
+    and the first `sample_rows` rows, which are held back until the widths
+    are known. Cells too wide for their columns are truncated, or wrapped
+    onto more lines if `overflow` is ``'wrap'``.
+
+    If `spill` is true, the table instead saves all its rows to a temporary
+    file and writes them when closed, with columns sized to fit every row.
+
+    """
+
+    def __init__(self, labels, out=None, widths=None, sample_rows=100, overflow='truncate', spill=False):
+        if overflow not in ('truncate', 'wrap'):
+            raise ValueError("overflow must be 'truncate' or 'wrap', not %r" % (overflow,))
+        self.out = out if out is not None else sys.stdout
+        self.overflow = overflow
+        self.sample_rows = sample_rows
+        # Columns are at least one character wide, so there's room to wrap.
+        self.widths = [max(1, width) for width in widths] if widths is not None else None
+        self.spill_file = None
+        self.pending = list()
+
+        labels = [self._cell(label) for label in labels]
+        if spill:
+            import tempfile
+            self.spill_file = tempfile.TemporaryFile(mode='w+')
+            self.widths = [max(1, len(label)) for label in labels]
+            self.labels = labels
+        elif self.widths is not None:
+            self._write_row(labels)
+        else:
+            self.pending.append(labels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _cell(self, value):
+        return value if isinstance(value, type('')) else '%s' % (value,)
 
     def add_row(self, values):
-        self.rows.append(values)
+        values = [self._cell(value) for value in values]
+
+        if self.spill_file is not None:
+            import json
+            self.widths = [max(width, len(value)) for width, value in zip(self.widths, values)]
+            self.spill_file.write(json.dumps(values))
+            self.spill_file.write('\n')
+        elif self.widths is not None:
+            self._write_row(values)
+        else:
+            self.pending.append(values)
+            if len(self.pending) > self.sample_rows:
+                self._write_pending()
+
+    def _write_pending(self):
+        """Size the columns to fit the held back rows, then write them."""
+        pending, self.pending = self.pending, list()
+        self.widths = [max(1, max(len(row[i]) for row in pending)) for i in range(len(pending[0]))]
+        for row in pending:
+            self._write_row(row)
+
+    def _write_row(self, values):
+        widths = self.widths
+        if all(len(value) <= width for value, width in zip(values, widths)):
+            lines = [values]
+        elif self.overflow == 'truncate':
+            lines = [[value[:width] for value, width in zip(values, widths)]]
+        else:
+            chunks = [[value[start:start + width] for start in range(0, len(value), width)] or ['']
+                for value, width in zip(values, widths)]
+            lines = [[cell_chunks[i] if i < len(cell_chunks) else '' for cell_chunks in chunks]
+                for i in range(max(len(cell_chunks) for cell_chunks in chunks))]
+
+        self.out.write(''.join('  '.join(value.ljust(width) for value, width in zip(line, widths)) + '\n'
+            for line in lines))
+
+    def close(self):
+        """Write any rows the table is still holding."""
+        if self.pending:
+            self._write_pending()
+        elif self.spill_file is not None:
+            import json
+            spill_file, self.spill_file = self.spill_file, None
+            self._write_row(self.labels)
+            spill_file.seek(0)
+            for line in spill_file:
+                self._write_row(json.loads(line))
+            spill_file.close()
+        self.out.flush()
+
+
+class _RecordWriter(object):
+
+    """A table that writes its rows to a file as machine readable records
+    instead of aligned text.
+
+    The `output_format` is one of ``'csv'``, ``'tsv'`` or ``'jsonl'``. CSV
+    and TSV output start with a header row of the `labels`; JSON Lines
+    output is one object per row, keyed by the labels.
+
+    Each row is written as soon as it's added. The newline ending the last
+    row is held back until another row is added or the table is closed or
+    printed, so that printing the table like a `prettytable.PrettyTable`
+    ends the output without adding an empty line.
+
+    The display settings of `prettytable.PrettyTable`, such as `align` and
+    `sortby`, are accepted so code written for tables still runs, but are
+    ignored: rows are written as they are, in the order they're added.
+
+    """
+
+    FORMATS = ('csv', 'tsv', 'jsonl')
+
+    sortby = None
+    reversesort = False
+    border = header = True
+    hrules = vrules = None
+    padding_width = 1
+    left_padding_width = right_padding_width = None
+
+    def __init__(self, output_format, labels=None, out=None):
+        if output_format not in self.FORMATS:
+            raise ValueError('unknown output format %r' % (output_format,))
+        self.output_format = output_format
+        self.labels = list(labels) if labels is not None else None
+        self.out = out if out is not None else sys.stdout
+        self.line_pending = False
+        self.align, self.valign = dict(), dict()
+        self.max_width, self.min_width = dict(), dict()
+        self.int_format, self.float_format = dict(), dict()
+
+        if output_format == 'csv':
+            import csv
+            self.lines = list()
+            self.csv_writer = csv.writer(self, lineterminator='')
+        elif output_format == 'jsonl':
+            import json
+            self.encoder = json.JSONEncoder(default=str, ensure_ascii=False)
+
+        if self.labels is not None and output_format != 'jsonl':
+            self._write_line(self._format_row(self.labels))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def __str__(self):
-        col_sizes = [max(len(self.rows[j][i]) for j in range(len(self.rows))) for i in range(len(self.rows[0]))]
-        format_str = '  '.join('{{: <{}}}'.format(size) for size in col_sizes)
-        return '\n'.join(format_str.format(*values) for values in self.rows)
+        # Let print() write the held back newline.
+        self.line_pending = False
+        return ''
+
+    def write(self, data):
+        """Collect output of the CSV writer."""
+        self.lines.append(data)
+
+    def _format_row(self, values):
+        if self.output_format == 'csv':
+            self.csv_writer.writerow(values)
+            line = ''.join(self.lines)
+            del self.lines[:]
+            return line
+        if self.output_format == 'tsv':
+            text = type(u'')
+            values = [text(value) for value in values]
+            line = '\t'.join(values)
+            if '\\' in line or line.count('\t') != len(values) - 1 or '\n' in line or '\r' in line:
+                line = '\t'.join(value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+                    for value in values)
+            return line
+        if self.labels is not None:
+            return self.encoder.encode(dict(zip(self.labels, values)))
+        return self.encoder.encode(list(values))
+
+    def _write_line(self, line):
+        if self.line_pending:
+            line = '\n' + line
+        self.out.write(line)
+        self.line_pending = True
+
+    @property
+    def field_names(self):
+        return self.labels
+
+    @field_names.setter
+    def field_names(self, labels):
+        # Like a PrettyTable made without labels, take them before any rows.
+        write_header = self.labels is None and not self.line_pending and self.output_format != 'jsonl'
+        self.labels = list(labels)
+        if write_header:
+            self._write_line(self._format_row(self.labels))
+
+    def add_row(self, values):
+        self._write_line(self._format_row(values))
+
+    def add_rows(self, rows):
+        for values in rows:
+            self.add_row(values)
+
+    def set_style(self, style):
+        """Ignore the table style `style`, as records have no style."""
+
+    def get_string(self, **kwargs):
+        """End the last row like printing the table, ignoring any display
+        settings in `kwargs`."""
+        return str(self)
+
+    def close(self):
+        """End the last row and flush the output."""
+        if self.line_pending:
+            self.out.write('\n')
+            self.line_pending = False
+        self.out.flush()
+
+
+_STREAM_CHUNK_SIZE = 1 << 20
+"""How many bytes of input `Termtool.records()` reads at a time."""
+
+_emit_lock = threading.Lock()
+"""The lock held while writing out records collected by `Termtool.emit()`."""
+
+_STRING_TYPES = (type(''), type(u''))
+
+
+def _read_records(path, encoding):
+    """Yield lists of the lines of the file at `path` (or stdin, if `path` is
+    ``-``) without their line endings, decompressing it if it's gzipped."""
+    import io
+
+    if path == '-':
+        try:
+            raw = io.open(sys.stdin.fileno(), 'rb', buffering=_STREAM_CHUNK_SIZE, closefd=False)
+        except (AttributeError, ValueError, io.UnsupportedOperation):
+            # Stdin isn't a real file, so read it as it is.
+            for line in sys.stdin:
+                yield [line.rstrip('\n')]
+            return
+    else:
+        raw = io.open(path, 'rb', buffering=_STREAM_CHUNK_SIZE)
+
+    try:
+        source = raw
+        if raw.peek(2)[:2] == b'\x1f\x8b':
+            import gzip
+            source = gzip.GzipFile(fileobj=raw)
+        text = io.TextIOWrapper(source, encoding=encoding)
+
+        # Splitting big chunks is faster than reading line by line (or
+        # reading lines from a memory map).
+        rest = ''
+        while True:
+            chunk = text.read(_STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            yield lines
+        if rest:
+            yield [rest]
+    finally:
+        if source is not raw:
+            source.close()
+        raw.close()
+
+
+try:
+    _wall_clock = time.perf_counter
+    _cpu_clock = time.process_time
+except AttributeError:
+    _wall_clock = time.time
+    _cpu_clock = time.clock
+
+
+try:
+    _monotonic_clock = time.monotonic
+except AttributeError:
+    _monotonic_clock = time.time
+
+
+def _peak_rss():
+    """Return the peak resident memory of the process in bytes, or ``None``
+    if the platform can't say."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts in kilobytes, but Mac OS X counts in bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _format_duration(seconds):
+    """Format a number of seconds as ``H:MM:SS``."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def _current_rss():
+    """Return the resident memory of the process in bytes, or its peak
+    resident memory where the platform can't say what it is now."""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return _peak_rss()
+
+
+def _parse_size(value):
+    """Parse a number of bytes with an optional ``K``, ``M`` or ``G`` suffix,
+    as given to the ``--max-rss`` option."""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*$', value, re.IGNORECASE)
+    if match is None:
+        raise argparse.ArgumentTypeError('invalid size %r (use a number of bytes, or a number with K, M or G)' % value)
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' kmg'.index(unit.lower() or ' '))
+
+
+class _LimitExceeded(BaseException):
+
+    """Raised in the main thread when a run exceeds one of its resource
+    limits, `limit` being ``'timeout'``, ``'cpu'`` or ``'memory'``.
+
+    Like `KeyboardInterrupt`, this isn't an `Exception`, so subcommands
+    catching all their errors don't catch it.
+
+    """
+
+    def __init__(self, limit):
+        super(_LimitExceeded, self).__init__(limit)
+        self.limit = limit
+
+
+class _ResourceLimits(object):
+
+    """A context manager limiting the wall clock time (`timeout`), CPU time
+    (`max_cpu`) and resident memory (`max_rss`) used by the code run in it.
+
+    The time limits are enforced with interval timers, and memory by a
+    watchdog thread checking the process's memory every `interval` seconds.
+    When a limit is exceeded, `_LimitExceeded` is raised in the main thread.
+    Limits that can't be enforced on this platform, or when not in the main
+    thread, are logged and ignored. With no limits, nothing is changed.
+
+    """
+
+    def __init__(self, timeout=None, max_cpu=None, max_rss=None, interval=0.1):
+        self.timeout = timeout
+        self.max_cpu = max_cpu
+        self.max_rss = max_rss
+        self.interval = interval
+        self.old_handlers = dict()
+        self.breached = None
+        self.watchdog = None
+
+    def _handle_signal(self, signum, frame):
+        import signal
+        if signum == signal.SIGPROF:
+            raise _LimitExceeded('cpu')
+        raise _LimitExceeded(self.breached or 'timeout')
+
+    def _watch_memory(self, stopped):
+        import signal
+        while not stopped.wait(self.interval):
+            rss = _current_rss()
+            if rss is not None and rss > self.max_rss:
+                self.breached = 'memory'
+                os.kill(os.getpid(), signal.SIGALRM)
+                return
+
+    def __enter__(self):
+        # Leave the signal handlers alone when there's nothing to limit.
+        if not (self.timeout or self.max_cpu or self.max_rss):
+            return self
+        try:
+            import signal
+            timers = [(signal.ITIMER_REAL, signal.SIGALRM, self.timeout),
+                (signal.ITIMER_PROF, signal.SIGPROF, self.max_cpu)]
+            for _, signum, _ in timers:
+                self.old_handlers[signum] = signal.signal(signum, self._handle_signal)
+        except (ImportError, AttributeError, ValueError):
+            logging.getLogger('termtool').warning('Resource limits are not available here, so the run is not limited')
+            self._restore_handlers()
+            return self
+
+        for which, _, seconds in timers:
+            if seconds:
+                signal.setitimer(which, seconds)
+
+        if self.max_rss:
+            stopped = threading.Event()
+            self.watchdog = threading.Thread(target=self._watch_memory, args=(stopped,))
+            self.watchdog.daemon = True
+            self.watchdog.stopped = stopped
+            self.watchdog.start()
+        return self
+
+    def _restore_handlers(self):
+        import signal
+        for signum, handler in self.old_handlers.items():
+            signal.signal(signum, handler)
+        self.old_handlers = dict()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.old_handlers:
+            return
+        import signal
+        # Stop the timers before anything else, so they can't go off after
+        # the code being limited has finished.
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        if self.watchdog is not None:
+            self.watchdog.stopped.set()
+            self.watchdog.join()
+            self.watchdog = None
+        self._restore_handlers()
+
+
+class _Progress(object):
+
+    """A progress report for a loop over many items.
+
+    Counting an item costs only an addition and a comparison. The clock is
+    checked only every so many items, a number adjusted after each check
+    to the rate items are counted, so that checks come several times per
+    display `interval`.
+
+    Progress is shown on the `group`'s terminal at most every `interval`
+    seconds, or if the group isn't displaying on a terminal, logged at
+    ``INFO`` level every `log_interval` seconds.
+
+    """
+
+    def __init__(self, group, iterable=None, total=None, label=None, unit='it', interval=0.1, log_interval=10.0):
+        if total is None and iterable is not None:
+            try:
+                total = len(iterable)
+            except TypeError:
+                pass
+        self.group = group
+        self.iterable = iterable
+        self.total = total
+        self.label = label or ''
+        self.unit = unit
+        self.interval = interval
+        self.log_interval = log_interval
+
+        self.count = 0
+        self.next_check = 1
+        self.closed = False
+        self.start_time = self.last_check_time = self.last_show_time = _monotonic_clock()
+        self.last_check_count = 0
+        group.add(self)
+
+    def __iter__(self):
+        # Count in a local variable, only updating the report at checks.
+        count, next_check = self.count, self.next_check
+        try:
+            for item in self.iterable:
+                yield item
+                count += 1
+                if count >= next_check:
+                    self.count = count
+                    self._check()
+                    next_check = self.next_check
+        finally:
+            self.count = count
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, count=1):
+        """Count `count` more items done."""
+        self.count += count
+        if self.count >= self.next_check:
+            self._check()
+
+    def _check(self):
+        now = _monotonic_clock()
+        elapsed = now - self.last_check_time
+        counted = self.count - self.last_check_count
+        self.last_check_time, self.last_check_count = now, self.count
+
+        # Aim to check the clock about four times per interval.
+        if elapsed > 0:
+            step = int(counted * self.interval / (4 * elapsed))
+        else:
+            step = counted * 2
+        self.next_check = self.count + max(1, step)
+
+        wait = self.interval if self.group.is_terminal else self.log_interval
+        if now - self.last_show_time >= wait:
+            self.last_show_time = now
+            self.group.show(self)
+
+    def rate(self):
+        """Return how many items have been counted per second."""
+        elapsed = _monotonic_clock() - self.start_time
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def describe(self, bar_width=20):
+        """Return a line describing the progress so far."""
+        rate = self.rate()
+        parts = [self.label] if self.label else []
+        if self.total:
+            fraction = min(1.0, float(self.count) / self.total)
+            filled = int(fraction * bar_width)
+            parts.append('[%s%s] %d/%d %3d%%' % ('#' * filled, ' ' * (bar_width - filled), self.count, self.total, fraction * 100))
+        else:
+            parts.append('%d %s' % (self.count, self.unit))
+        parts.append('%.1f %s/s' % (rate, self.unit))
+        if self.closed:
+            parts.append('in %s' % _format_duration(_monotonic_clock() - self.start_time))
+        elif self.total and rate > 0:
+            parts.append('ETA %s' % _format_duration(max(0, self.total - self.count) / rate))
+        return ' '.join(parts)
+
+    def close(self):
+        """Show the final progress and stop displaying this progress."""
+        if not self.closed:
+            self.closed = True
+            self.group.remove(self)
+
+
+class _ProgressGroup(object):
+
+    """The progress reports displayed together on one terminal, one line
+    each, such as those of parallel workers."""
+
+    def __init__(self, out):
+        self.out = out
+        self.is_terminal = hasattr(out, 'isatty') and out.isatty()
+        self.lock = threading.Lock()
+        self.reports = list()
+        self.lines_shown = 0
+
+    def add(self, report):
+        with self.lock:
+            self.reports.append(report)
+
+    def remove(self, report):
+        with self.lock:
+            if self.is_terminal:
+                # Move the finished report to the top, where it stays after
+                # its final update.
+                self.reports.remove(report)
+                self.reports.insert(0, report)
+                self._draw()
+                self.reports.remove(report)
+                self.lines_shown -= 1
+            else:
+                self.reports.remove(report)
+                logging.info('%s', report.describe())
+
+    def show(self, report):
+        if not self.is_terminal:
+            logging.info('%s', report.describe())
+            return
+        # Skip this update if another thread is already drawing.
+        if self.lock.acquire(False):
+            try:
+                self._draw()
+            finally:
+                self.lock.release()
+
+    def _draw(self):
+        lines = [report.describe() + '\033[K\n' for report in self.reports]
+        if self.lines_shown:
+            lines.insert(0, '\033[%dA' % self.lines_shown)
+        self.out.write('\r' + ''.join(lines))
+        self.out.flush()
+        self.lines_shown = len(self.reports)
+
+
+_config_file_cache = dict()
+"""Parsed config files, keyed on path, with the stats they were read with."""
+
+
+def _read_config_lines(filepath):
+    """Read the config file at `filepath`.
+
+    Returns a list of the global arguments in the file, and a dictionary of
+    lists of arguments in its subcommand sections, keyed on subcommand name.
+    Missing files have no arguments. Files that haven't changed since they
+    were last read aren't read again.
+
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return list(), dict()
+
+    signature = (stat.st_mtime, stat.st_size, stat.st_ino)
+    try:
+        cached_signature, config = _config_file_cache[filepath]
+    except KeyError:
+        pass
+    else:
+        if cached_signature == signature:
+            return list(config[0]), dict((name, list(args)) for name, args in config[1].items())
+
+    try:
+        with open(filepath, 'r') as config_file:
+            lines = [line.strip('\n') for line in config_file.readlines()]
+    except IOError:
+        return list(), dict()
+
+    config_args, config_sections = list(), dict()
+    current = config_args
+    for line in lines:
+        if line.startswith('[') and line.endswith(']') and len(line) > 2:
+            current = config_sections.setdefault(line[1:-1], list())
+        else:
+            current.append(line)
+
+    _config_file_cache[filepath] = (signature, (config_args, config_sections))
+    return list(config_args), dict((name, list(args)) for name, args in config_sections.items())
+
+
+def _cache_dir():
+    """Return the directory where termtool keeps its cache files."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'termtool')
+
+
+def _state_dir():
+    """Return the directory where termtool keeps state that should last
+    between runs."""
+    state_home = os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+    return os.path.join(state_home, 'termtool')
+
+
+def _write_file_atomically(filepath, contents, mode=None):
+    """Replace the file at `filepath` with `contents` all at once.
+
+    The contents are written to a temporary file that only the user can read
+    (unless another `mode` is given), which is then renamed into place, so
+    readers never see a partly written file. The file's directory is created
+    if necessary.
+
+    """
+    import tempfile
+
+    dirpath = os.path.dirname(filepath)
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath, 0o700)
+
+    fd, temppath = tempfile.mkstemp(dir=dirpath, prefix='.%s.' % os.path.basename(filepath))
+    try:
+        if mode is not None:
+            os.chmod(temppath, mode)
+        with os.fdopen(fd, 'w') as temp_file:
+            temp_file.write(contents)
+            # Make sure the contents are on disk before the new name is, so
+            # a crash can't leave an empty file in place of the old one.
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        getattr(os, 'replace', os.rename)(temppath, filepath)
+    except:
+        os.remove(temppath)
+        raise
+
+
+class _FileLock(object):
+
+    """An advisory lock on a ``.lock`` file next to the file at `filepath`,
+    or on the file at `lockpath` if given, held while used as a context
+    manager.
+
+    The lock is separate from the file itself, since atomically replacing the
+    file also replaces any lock held on it. Where `fcntl` isn't available,
+    the lock does nothing.
+
+    """
+
+    def __init__(self, filepath, lockpath=None):
+        self.lockpath = lockpath if lockpath is not None else filepath + '.lock'
+        self.fd = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        dirpath = os.path.dirname(self.lockpath)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath, 0o700)
+        self.fd = os.open(self.lockpath, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.fd is not None:
+            # Closing the file releases the lock.
+            os.close(self.fd)
+            self.fd = None
+
+
+_UNCACHED_ARGS = frozenset(('func', 'subcommand', 'loglevel', 'color', '_termtool_log_json',
+    '_termtool_log_async', '_termtool_jobs', '_termtool_profile', '_termtool_profile_file', '_termtool_timings',
+    '_termtool_concurrency', '_termtool_batch', '_termtool_cache', '_termtool_refresh',
+    '_termtool_timeout', '_termtool_max_cpu', '_termtool_max_rss', '_termtool_metrics',
+    '_termtool_resume'))
+"""The parsed arguments that don't change what a subcommand does, so aren't
+part of the key identifying a run for its cached output or checkpoints."""
+
+
+class _CapturingOutput(object):
+
+    """A wrapper for standard output keeping a copy of the text written to
+    it, as long as there's no more than `limit` characters of it."""
+
+    def __init__(self, out, limit):
+        self.out = out
+        self.limit = limit
+        self.chunks = list()
+        self.size = 0
+        self.overflowed = False
+
+    def write(self, data):
+        self.out.write(data)
+        if self.overflowed:
+            return
+        self.size += len(data)
+        if self.size > self.limit:
+            self.overflowed = True
+            self.chunks = list()
+        else:
+            self.chunks.append(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+
+def _read_cached_result(filepath, ttl):
+    """Return the exit code and output saved in the result cache file at
+    `filepath`, or ``None`` if there isn't one less than `ttl` seconds old."""
+    import json
+    try:
+        with open(filepath, 'r') as cache_file:
+            header = json.loads(cache_file.readline())
+            if time.time() - header['created'] > ttl:
+                return None
+            output = cache_file.read()
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+    # Mark the result as recently used, so it's evicted last.
+    try:
+        os.utime(filepath, None)
+    except OSError:
+        pass
+    return header['status'], output
+
+
+def _save_cached_result(filepath, status, output, max_size):
+    """Save the exit code `status` and `output` of a run in the result cache
+    file at `filepath`, then evict the least recently used results until the
+    cache is no bigger than `max_size` bytes."""
+    import json
+    header = json.dumps({'status': status, 'created': time.time()})
+    try:
+        _write_file_atomically(filepath, '%s\n%s' % (header, output))
+    except (IOError, OSError):
+        return
+
+    dirpath = os.path.dirname(filepath)
+    entries = list()
+    for filename in os.listdir(dirpath):
+        # Leave alone the temporary files of results being saved.
+        if filename.startswith('.'):
+            continue
+        entry_path = os.path.join(dirpath, filename)
+        try:
+            stat = os.stat(entry_path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+        total -= size
+
+
+class _Checkpoints(object):
+
+    """The checkpointed state of a run, saved in the file at `filepath`.
+
+    New state is written out at most every `interval` seconds, so however
+    often the run checkpoints, the file is only written now and then. A
+    timer marks when a write is due, so checkpointing doesn't read the clock.
+    If `resume` is true, the state saved by an earlier run is read back.
+
+    """
+
+    def __init__(self, filepath, interval, resume):
+        self.filepath = filepath
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.due = False
+        self.timer = None
+        self._start_timer()
+
+        self.restored = dict()
+        if resume:
+            self.restored = self._load()
+        elif os.path.exists(filepath):
+            logging.warning('Starting over, replacing the progress saved by an '
+                'earlier run; use --resume to continue from it instead')
+        # Keep the restored state of keys this run doesn't checkpoint again.
+        self.state = dict(self.restored)
+
+    def _load(self):
+        import json
+        try:
+            with open(self.filepath, 'r') as state_file:
+                return json.load(state_file)['state']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return dict()
+
+    def _start_timer(self):
+        self.timer = threading.Timer(self.interval, self._make_due)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _make_due(self):
+        self.due = True
+
+    def _stop_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def set(self, key, state):
+        # Setting a key of the dict is atomic, so only writing the file needs
+        # the lock.
+        self.state[key] = state
+        self.dirty = True
+        if self.due:
+            with self.lock:
+                if self.due:
+                    self._start_timer()
+                    self._write()
+
+    def flush(self):
+        """Write out any state not yet saved, returning whether there's any
+        state saved."""
+        with self.lock:
+            self._stop_timer()
+            if self.dirty:
+                self._write()
+            return bool(self.state)
+
+    def _write(self):
+        import json
+        # Mark the state saved before copying it, so state set meanwhile in
+        # other threads is saved next time.
+        self.dirty = self.due = False
+        try:
+            contents = json.dumps({'saved': time.time(), 'state': dict(self.state)})
+            _write_file_atomically(self.filepath, contents)
+        except:
+            self.dirty = True
+            raise
+        # Make sure the new file's name is on disk too.
+        try:
+            dir_fd = os.open(os.path.dirname(self.filepath), os.O_RDONLY)
+        except (OSError, AttributeError):
+            pass
+        else:
+            try:
+                os.fsync(dir_fd)
+            except OSError:
+                pass
+            finally:
+                os.close(dir_fd)
+
+    def discard(self):
+        """Forget the saved state, as when the run finishes its work."""
+        with self.lock:
+            self._stop_timer()
+            self.dirty = False
+            try:
+                os.remove(self.filepath)
+            except OSError:
+                pass
+
+
+class _NullMetrics(object):
+
+    """Metrics that aren't collected, for runs with no metrics sink."""
+
+    counters = gauges = {}
+
+    def increment(self, name, value=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+
+class _Metrics(object):
+
+    """The counters and gauges subcommands record during a run."""
+
+    def __init__(self):
+        self.counters = dict()
+        self.gauges = dict()
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        """Add `value` to the counter `name`."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """Set the gauge `name` to `value`."""
+        self.gauges[name] = value
+
+
+def _send_metrics_record(sink, record):
+    """Send the metrics `record` of a run to `sink`, a ``statsd://``,
+    ``prometheus:`` or ``jsonl:`` address."""
+    kind, _, target = sink.partition(':')
+    if target.startswith('//'):
+        target = target[2:]
+    if kind == 'statsd':
+        _send_statsd_metrics(target, record)
+    elif kind == 'prometheus':
+        _write_prometheus_metrics(target, record)
+    elif kind == 'jsonl':
+        _append_jsonl_metrics(target, record)
+    else:
+        raise ValueError('unknown kind of metrics sink %r' % kind)
+
+
+def _send_statsd_metrics(address, record):
+    """Send `record` to the StatsD server at `address` (``host:port``) in
+    non-blocking UDP packets."""
+    import socket
+
+    host, _, port = address.rpartition(':')
+    if not host:
+        host, port = port, ''
+    port = int(port or 8125)
+
+    def clean(name):
+        return re.sub(r'[^\w-]', '_', str(name))
+
+    prefix = 'termtool.%s.%s' % (clean(record['tool']), clean(record['subcommand']))
+    lines = [
+        '%s.runs:1|c' % prefix,
+        '%s.duration:%d|ms' % (prefix, record['duration'] * 1000),
+        '%s.exit_code:%d|g' % (prefix, record['exit_code']),
+    ]
+    if record['exit_code']:
+        lines.append('%s.failures:1|c' % prefix)
+    if record['peak_rss'] is not None:
+        lines.append('%s.peak_rss:%d|g' % (prefix, record['peak_rss']))
+    lines.extend('%s.%s:%s|c' % (prefix, clean(name), value) for name, value in sorted(record['counters'].items()))
+    lines.extend('%s.%s:%s|g' % (prefix, clean(name), value) for name, value in sorted(record['gauges'].items()))
+
+    # Keep packets small enough not to be fragmented.
+    packets, packet = list(), ''
+    for line in lines:
+        if packet and len(packet) + len(line) + 1 > 1400:
+            packets.append(packet)
+            packet = ''
+        packet = '%s\n%s' % (packet, line) if packet else line
+    packets.append(packet)
+
+    family, socktype, proto, _, sockaddr = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, socktype, proto)
+    try:
+        sock.setblocking(False)
+        for packet in packets:
+            sock.sendto(packet.encode('utf-8'), sockaddr)
+    finally:
+        sock.close()
+
+
+_PROMETHEUS_METRICS = (
+    ('termtool_runs_total', 'counter', 'Runs of the subcommand.'),
+    ('termtool_run_failures_total', 'counter', 'Runs of the subcommand that exited with a nonzero code.'),
+    ('termtool_last_run_timestamp_seconds', 'gauge', 'When the last run of the subcommand finished.'),
+    ('termtool_last_run_duration_seconds', 'gauge', 'How long the last run of the subcommand took.'),
+    ('termtool_last_run_exit_code', 'gauge', 'The exit code of the last run of the subcommand.'),
+    ('termtool_last_run_peak_rss_bytes', 'gauge', 'The peak resident memory of the last run of the subcommand.'),
+    ('termtool_last_run_counter', 'gauge', 'Counters incremented by the last run of the subcommand.'),
+    ('termtool_last_run_gauge', 'gauge', 'Gauges set by the last run of the subcommand.'),
+)
+"""The metrics written to Prometheus textfiles, with their types and help."""
+
+
+def _prometheus_labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (key, escape(value)) for key, value in sorted(labels.items()))
+
+
+def _write_prometheus_metrics(path, record):
+    """Update the Prometheus node exporter textfile at `path` (or the
+    ``toolname.prom`` file, if `path` is a directory) with `record`.
+
+    The samples for the record's subcommand are replaced and its run totals
+    counted up, leaving the samples for other subcommands alone.
+
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, '%s.prom' % record['tool'])
+    labels = dict(tool=record['tool'], subcommand=record['subcommand'])
+    run_labels = _prometheus_labels(**labels)
+
+    with _FileLock(path):
+        samples = OrderedDict()
+        try:
+            with open(path, 'r') as prom_file:
+                for line in prom_file:
+                    match = re.match(r'^(\w+)(\{.*\})? (\S+)$', line.strip())
+                    if match is not None:
+                        samples[match.group(1), match.group(2) or ''] = match.group(3)
+        except IOError:
+            pass
+
+        # Forget the last run's samples, in case it had other counters.
+        own_labels = run_labels[:-1]
+        for name, sample_labels in list(samples):
+            if name.startswith('termtool_last_run_') and (sample_labels == run_labels
+                    or sample_labels.startswith(own_labels + ',')):
+                del samples[name, sample_labels]
+
+        def count_up(name, value):
+            previous = float(samples.get((name, run_labels), 0))
+            samples[name, run_labels] = repr(previous + value)
+
+        count_up('termtool_runs_total', 1)
+        count_up('termtool_run_failures_total', 1 if record['exit_code'] else 0)
+        samples['termtool_last_run_timestamp_seconds', run_labels] = repr(record['time'])
+        samples['termtool_last_run_duration_seconds', run_labels] = repr(record['duration'])
+        samples['termtool_last_run_exit_code', run_labels] = str(record['exit_code'])
+        if record['peak_rss'] is not None:
+            samples['termtool_last_run_peak_rss_bytes', run_labels] = str(record['peak_rss'])
+        for name, value in record['counters'].items():
+            samples['termtool_last_run_counter', _prometheus_labels(counter=name, **labels)] = repr(value)
+        for name, value in record['gauges'].items():
+            samples['termtool_last_run_gauge', _prometheus_labels(gauge=name, **labels)] = repr(value)
+
+        lines = list()
+        for name, metric_type, help_text in _PROMETHEUS_METRICS:
+            metric_samples = sorted((sample_labels, value) for (sample_name, sample_labels), value
+                in samples.items() if sample_name == name)
+            if not metric_samples:
+                continue
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            lines.extend('%s%s %s' % (name, sample_labels, value) for sample_labels, value in metric_samples)
+        # The node exporter must never read a partly written file, and
+        # usually runs as another user.
+        _write_file_atomically(path, '\n'.join(lines) + '\n', mode=0o644)
+
+
+def _append_jsonl_metrics(path, record):
+    """Append `record` to the file of JSON lines at `path`."""
+    import json
+    # One write of a short line to a file opened for appending won't be
+    # mixed up with other processes' lines.
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, (json.dumps(record) + '\n').encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def _iter_entry_points(group):
+    """Yield the names and targets (``module:attribute``) of the installed
+    entry points in `group`."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        for entry_point in pkg_resources.iter_entry_points(group):
+            yield entry_point.name, '%s:%s' % (entry_point.module_name, '.'.join(entry_point.attrs))
+        return
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        entry_points = entry_points.select(group=group)
+    else:
+        entry_points = entry_points.get(group, ())
+    for entry_point in entry_points:
+        yield entry_point.name, entry_point.value
+
+
+def _load_entry_point(target):
+    """Import and return the object named by the entry point `target`."""
+    import importlib
+    module_name, _, attr_path = target.partition(':')
+    # Leave out any extras, as in ``module:attr [extra]``.
+    attr_path = attr_path.split('[', 1)[0].strip()
+    obj = importlib.import_module(module_name.strip())
+    for attr in attr_path.split('.') if attr_path else ():
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _completion_actions(parser):
+    """Describe the options and positional arguments of `parser` for shell
+    completion, as a list of option dictionaries and a list of positional
+    argument dictionaries."""
+    options, positionals = list(), list()
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction) or action.help == argparse.SUPPRESS:
+            continue
+        choices = [str(choice) for choice in action.choices] if action.choices else None
+        if action.option_strings:
+            options.append({
+                'strings': list(action.option_strings),
+                'value': action.nargs != 0,
+                'optional': action.nargs in (argparse.OPTIONAL, argparse.ZERO_OR_MORE),
+                'choices': choices,
+                'dest': action.dest,
+                'help': action.help or '',
+            })
+        else:
+            positionals.append({'dest': action.dest, 'choices': choices})
+    return options, positionals
+
+
+def _shell_quote(value):
+    """Quote `value` as a single word for a POSIX shell or fish."""
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+def _bash_completion_script(prog, appname, completion):
+    """Return a bash completion script for the command `prog` described by
+    the `completion` dictionary.
+
+    The script uses only shell builtins, so completing doesn't run the tool.
+    Values for options and positional arguments with no choices are read
+    from the tool's completion cache files.
+
+    """
+    ident = re.sub(r'\W', '_', prog)
+    values_fn = '_termtool_%s_values' % ident
+    words_fn = '_termtool_%s_words' % ident
+
+    def words(items):
+        return ' '.join(_shell_quote(item) for item in items)
+
+    def value_cases(options, indent):
+        lines = list()
+        for option in options:
+            if not option['value']:
+                continue
+            if option['choices']:
+                action = '%s %s' % (words_fn, words(option['choices']))
+            else:
+                action = '%s %s' % (values_fn, _shell_quote(option['dest']))
+            lines.append('%s%s) %s; return ;;' % (indent, '|'.join(option['strings']), action))
+        return lines
+
+    global_options = completion['options']
+    global_strings = [string for option in global_options for string in option['strings']]
+    # Skip the values of global options that must have one when looking
+    # for the subcommand.
+    value_strings = [string for option in global_options
+        if option['value'] and not option['optional'] for string in option['strings']]
+
+    lines = [
+        '# bash completion for %s, generated by termtool %s' % (prog, __version__),
+        '%s() {' % words_fn,
+        '    local word',
+        '    for word; do',
+        '        [[ $word == "$cur"* ]] && COMPREPLY+=("$word")',
+        '    done',
+        '}',
+        '',
+        '%s() {' % values_fn,
+        '    local file="${XDG_CACHE_HOME:-$HOME/.cache}/termtool/%s.completions/$1" line' % appname,
+        '    [[ -r $file ]] || return',
+        '    while IFS= read -r line; do',
+        '        [[ $line == "$cur"* ]] && COMPREPLY+=("$line")',
+        '    done < "$file"',
+        '}',
+        '',
+        '_termtool_%s() {' % ident,
+        '    local cur="${COMP_WORDS[COMP_CWORD]}" prev="${COMP_WORDS[COMP_CWORD-1]}"',
+        '    local command="" i',
+        '    COMPREPLY=()',
+        '    for ((i = 1; i < COMP_CWORD; i++)); do',
+        '        case "${COMP_WORDS[i]}" in',
+    ]
+    if value_strings:
+        lines.append('            %s) ((i++)) ;;' % '|'.join(value_strings))
+    lines.extend([
+        '            -*) ;;',
+        '            *) command="${COMP_WORDS[i]}"; break ;;',
+        '        esac',
+        '    done',
+        '',
+        '    case "$command" in',
+    ])
+    for command in completion['commands']:
+        cases = value_cases(command['options'], ' ' * 16)
+        if cases:
+            lines.append('        %s)' % '|'.join(command['names']))
+            lines.append('            case "$prev" in')
+            lines.extend(cases)
+            lines.append('            esac ;;')
+    lines.extend([
+        '    esac',
+        '    case "$prev" in',
+    ])
+    lines.extend(value_cases(global_options, ' ' * 8))
+    lines.extend([
+        '    esac',
+        '',
+        '    if [[ $cur == -* ]]; then',
+        '        case "$command" in',
+        '            "") %s %s ;;' % (words_fn, words(global_strings)),
+    ])
+    for command in completion['commands']:
+        strings = [string for option in command['options'] for string in option['strings']]
+        lines.append('            %s) %s %s ;;' % ('|'.join(command['names']), words_fn,
+            words(strings + global_strings)))
+    lines.extend([
+        '        esac',
+        '        return',
+        '    fi',
+        '',
+        '    case "$command" in',
+        '        "") %s %s ;;' % (words_fn, words(name for command in completion['commands']
+            for name in command['names'])),
+    ])
+    for command in completion['commands']:
+        actions = list()
+        for positional in command['positionals']:
+            if positional['choices']:
+                actions.append('%s %s' % (words_fn, words(positional['choices'])))
+            else:
+                actions.append('%s %s' % (values_fn, _shell_quote(positional['dest'])))
+        if actions:
+            lines.append('        %s) %s ;;' % ('|'.join(command['names']), '; '.join(actions)))
+    lines.extend([
+        '    esac',
+        '}',
+        '',
+        'complete -o default -F _termtool_%s %s' % (ident, prog),
+        '',
+    ])
+    return '\n'.join(lines)
+
+
+def _fish_completion_script(prog, appname, completion):
+    """Return a fish completion script for the command `prog` described by
+    the `completion` dictionary."""
+    ident = re.sub(r'\W', '_', prog)
+    values_fn = '__termtool_%s_values' % ident
+
+    def option_line(option, condition=None):
+        parts = ['complete', '-c', prog]
+        if condition:
+            parts.extend(['-n', _shell_quote(condition)])
+        for string in option['strings']:
+            if string.startswith('--'):
+                parts.extend(['-l', string[2:]])
+            elif len(string) == 2:
+                parts.extend(['-s', string[1:]])
+            else:
+                parts.extend(['-o', string[1:]])
+        if option['value']:
+            parts.append('-r')
+            if option['choices']:
+                parts.extend(['-f', '-a', _shell_quote(' '.join(option['choices']))])
+            else:
+                parts.extend(['-a', _shell_quote('(%s %s)' % (values_fn, option['dest']))])
+        if option['help']:
+            parts.extend(['-d', _shell_quote(option['help'])])
+        return ' '.join(parts)
+
+    lines = [
+        '# fish completion for %s, generated by termtool %s' % (prog, __version__),
+        'function %s' % values_fn,
+        '    set -l cache_home $HOME/.cache',
+        '    set -q XDG_CACHE_HOME; and set cache_home $XDG_CACHE_HOME',
+        '    set -l file $cache_home/termtool/%s.completions/$argv[1]' % appname,
+        '    test -r $file; or return',
+        '    while read -l line',
+        '        echo $line',
+        '    end < $file',
+        'end',
+        '',
+    ]
+    lines.extend(option_line(option) for option in completion['options'])
+    for command in completion['commands']:
+        for name in command['names']:
+            line = 'complete -c %s -f -n __fish_use_subcommand -a %s' % (prog, _shell_quote(name))
+            if command['help']:
+                line += ' -d %s' % _shell_quote(command['help'])
+            lines.append(line)
+        condition = '__fish_seen_subcommand_from %s' % ' '.join(command['names'])
+        lines.extend(option_line(option, condition) for option in command['options'])
+        for positional in command['positionals']:
+            if positional['choices']:
+                values = ' '.join(positional['choices'])
+            else:
+                values = '(%s %s)' % (values_fn, positional['dest'])
+            lines.append('complete -c %s -n %s -a %s' % (prog, _shell_quote(condition),
+                _shell_quote(values)))
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _is_plain_data(value):
+    """Return whether `value` is made only of strings, numbers, lists and
+    dictionaries, so it survives a round trip through JSON unchanged."""
+    if value is None or isinstance(value, (bool, int, float, type(''), type(u''))):
+        return True
+    if isinstance(value, list):
+        return all(_is_plain_data(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, type('')) and _is_plain_data(item)
+            for key, item in value.items())
+    return False
+
+
+class _ImportedAttribute(object):
+
+    """A class attribute whose value is imported from another module the
+    first time it's used.
+
+    Tools that never use the attribute then don't pay to import its module.
+    If the module can't be imported, the attribute's value is `fallback`, or
+    the attribute is missing if there is no fallback.
+
+    """
+
+    def __init__(self, module, name, fallback=None):
+        self.module = module
+        self.name = name
+        self.fallback = fallback
+
+    def __get__(self, instance, owner):
+        try:
+            return self.value
+        except AttributeError:
+            pass
+
+        try:
+            module = __import__(self.module, fromlist=[self.name])
+            value = getattr(module, self.name)
+        except (ImportError, AttributeError):
+            if self.fallback is None:
+                raise AttributeError('%s.%s is not available' % (self.module, self.name))
+            value = self.fallback
+
+        self.value = value
+        return value
 
 
 class _TermtoolMetaclass(type):
 
     """Metaclass for `Termtool` classes.
 
-    This metaclass automatically sets the ``_subcommands`` class attribute to a
-    list of class attributes that have ``_subcommand`` attributes -- that is,
-    all the methods decorated with the `subcommand()` decorator.
+    This metaclass automatically sets the ``_subcommands_by_name`` class
+    attribute to an ordered dictionary of the methods decorated with the
+    `subcommand()` decorator, keyed on subcommand name in asciibetical order.
+    Subcommands are collected from all the class's base classes and mixins
+    too. Where two classes define a subcommand of the same name, or a class
+    replaces a base class's subcommand method with another attribute, the
+    class earlier in the method resolution order wins.
+
+    The ``_subcommands`` class attribute is a list of the same methods, and
+    ``_subcommand_names`` maps the names and aliases of the subcommands to
+    their subcommand names.
 
     """
 
     def __new__(cls, name, bases, attrs):
-        attrs['_subcommands'] = [attr for attr in attrs.values()
-            if hasattr(attr, '_subcommand')]
-        return super(_TermtoolMetaclass, cls).__new__(cls, name, bases, attrs)
+        klass = super(_TermtoolMetaclass, cls).__new__(cls, name, bases, attrs)
+
+        commands = dict()
+        for base in reversed(klass.__mro__):
+            for attr_name, attr in vars(base).items():
+                # An attribute overriding a subcommand method replaces it.
+                for command_name, command in list(commands.items()):
+                    if command.__name__ == attr_name and command is not attr:
+                        del commands[command_name]
+                if hasattr(attr, '_subcommand'):
+                    commands[attr._subcommand[0]] = attr
+
+        klass._subcommands_by_name = OrderedDict(sorted(commands.items()))
+        klass._subcommands = list(klass._subcommands_by_name.values())
+        names = dict()
+        for command_name, command in klass._subcommands_by_name.items():
+            names[command_name] = command_name
+            for alias in command._subcommand[1].get('aliases', ()):
+                names.setdefault(alias, command_name)
+        klass._subcommand_names = names
+        return klass
 
 
 _TermtoolSuperclass = _TermtoolMetaclass('_TermtoolSuperclass', (object,), {})
@@ -96,21 +1718,275 @@ class Termtool(_TermtoolSuperclass):
 
     """
 
-    try:
-        from progressbar import ProgressBar as progressbar
-    except ImportError:
-        # Well, don't use it I guess?
-        pass
+    EXIT_TIMEOUT = 124
+    """The exit code when a run takes longer than its ``--timeout``, the same
+    as the ``timeout`` command uses."""
 
-    try:
-        from prettytable import PrettyTable as table
-    except ImportError:
-        # Use our tiny replacement, which means we really can't use any of prettytable's specific features, but I guess we'll live.
-        table = _TinyTable
+    EXIT_MEMORY_LIMIT = 128 + 9
+    """The exit code when a run uses more memory than its ``--max-rss``, the
+    same as a shell reports for a process killed by the kernel for using too
+    much memory."""
+
+    EXIT_BROKEN_PIPE = 128 + 13
+    """The exit code when the reader of the tool's output goes away, the same
+    as a shell reports for a process killed by ``SIGPIPE``."""
+
+    EXIT_CPU_LIMIT = 128 + 24
+    """The exit code when a run uses more CPU time than its ``--max-cpu``,
+    the same as a shell reports for a process killed by ``SIGXCPU``."""
+
+    # Well, if progressbar isn't available, don't use it I guess?
+    progressbar = _ImportedAttribute('progressbar', 'ProgressBar')
+
+    # Without prettytable, use our tiny replacement, which means we really can't use any of prettytable's specific features, but I guess we'll live.
+    table_class = _ImportedAttribute('prettytable', 'PrettyTable', fallback=_TinyTable)
+    """The class of tables made by `table()` for the ``table`` output format."""
+
+    output_format = 'table'
+    """The format in which `table()` and `stream_table()` tables display
+    their rows, as set by the ``--format`` option."""
 
     log_format = '%(levelcolor)s%(levelname)s%(resetcolor)s %(message)s'
     """The logging format string that `configure_tool()` will configure logging with."""
 
+    log_json = False
+    """Whether `configure_tool()` formats log records as lines of JSON
+    instead of with `log_format`, as if the ``--log-json`` option were given."""
+
+    log_async = False
+    """Whether `configure_tool()` has log records written by a background
+    thread, as if the ``--log-async`` option were given."""
+
+    lazy_arg_parser = False
+    """Whether `main()` builds only the subparser for the invoked subcommand.
+
+    Tools with many subcommands can set this to save building parsers for all
+    the subcommands that aren't being run."""
+
+    profile_limit = 25
+    """How many functions the ``--profile`` option prints when not saving
+    the profile to a file."""
+
+    timings = None
+    """The time spent in each step of the last `main()` run.
+
+    This is an ordered dictionary of ``(wall, cpu, peak_rss)`` tuples keyed
+    on the names of the steps: ``read_config_file``, ``build_arg_parser``,
+    ``parse_args``, ``configure_tool`` and ``subcommand``. Times are in
+    seconds, and `peak_rss` is the process's peak resident memory in bytes
+    (or ``None`` if unavailable) when the step finished."""
+
+    subcommand_options = ()
+    """The names of termtool's subcommand options to give all the tool's
+    subcommands, of ``'jobs'``, ``'concurrency'``, ``'cache'`` and
+    ``'resume'``.
+
+    Every subcommand takes ``--format``. Subcommands are given the other
+    options that apply to them without this: ``--jobs`` if they're
+    `parallel`, ``--concurrency`` if they're ``async def``,
+    ``--no-cache`` and ``--refresh`` if they have a `cache_ttl`, and
+    ``--resume`` if they call `checkpoint()` or `restore()`. Tools whose
+    subcommands use these through other methods can name them here."""
+
+    plugin_group = None
+    """The name of the entry point group to load more subcommands from, such
+    as ``'termtool.subcommands'``.
+
+    Each entry point names a function decorated with `subcommand()`, which is
+    called with the `Termtool` instance and the parsed arguments. The names
+    and help of the plugin subcommands are cached in the user's cache
+    directory, so a plugin is only imported when it's invoked."""
+
+    result_cache_size = 64 * 1024 * 1024
+    """The most bytes of output saved for subcommands with a `cache_ttl`.
+    The least recently used output is removed to make room for more."""
+
+    checkpoint_interval = 5.0
+    """The fewest seconds between writes of the state saved with
+    `checkpoint()`."""
+
+    _run_args = None
+    _checkpoints = None
+
+    metrics = _NullMetrics()
+    """The metrics of the current run, for subcommands to add their own
+    counts to with ``self.metrics.increment(name)`` and
+    ``self.metrics.gauge(name, value)``. These are only collected when the
+    run has a `metrics_sink`, and not from `parallel` subcommands run in a
+    process pool."""
+
+    metrics_sink = None
+    """Where to send metrics about each run, if not given with the
+    ``--metrics`` option: ``statsd://HOST:PORT`` for a StatsD server,
+    ``prometheus:PATH`` for a Prometheus node exporter textfile (or a
+    directory of them), or ``jsonl:PATH`` to append them to a file of JSON
+    lines."""
+
+    emit_flush_lines = None
+    """How many records `emit()` collects before writing them to standard
+    output. By default, records are written one at a time when standard
+    output is a terminal, and 4096 at a time otherwise."""
+
+    _RUN_STATE = ('_log_listener', 'metrics', '_checkpoints', '_progress_group', '_warm_parser')
+    """The attributes holding the state of the tool's current run, such as
+    threads and locks, which are left behind when the tool is pickled."""
+
+    def __getstate__(self):
+        # Process pool workers get a pickled copy of the tool. They fall back
+        # to the class defaults for the state of the run, such as metrics
+        # that aren't collected.
+        state = self.__dict__.copy()
+        for name in self._RUN_STATE:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def table(self, *args, **kwargs):
+        """Return a new table for displaying rows of information.
+
+        When the tool's output format is ``table``, the table is an instance
+        of the tool's `table_class`, normally `prettytable.PrettyTable`, and
+        the arguments are passed to its constructor.
+
+        When the user asked for a machine readable ``--format`` (``csv``,
+        ``tsv`` or ``jsonl``), the table instead writes each row to standard
+        output in that format as soon as it's added. The only argument used
+        is the list of field names. Print the table or call its `close()`
+        method after adding all the rows.
+
+        """
+        if self.output_format != 'table':
+            field_names = args[0] if args else kwargs.get('field_names')
+            return _RecordWriter(self.output_format, field_names, out=sys.stdout)
+        return self.table_class(*args, **kwargs)
+
+    def progress(self, iterable=None, total=None, label=None, **kwargs):
+        """Return a new progress report for a long loop.
+
+        Iterate over the report to count each item of `iterable` as it's
+        done, or call the report's ``update(count)`` method to count items
+        done in a stream of unknown length. The number of items expected can
+        be given as `total`, or is taken from the length of `iterable`.
+
+        While on a terminal, the report is redrawn on stderr at most every
+        `interval` seconds (0.1 by default) with the items done, the rate
+        and an estimated time to finish. When stderr isn't a terminal, the
+        progress is logged every `log_interval` seconds (10 by default)
+        instead. Reports made at the same time, such as by parallel
+        workers, are displayed one per line.
+
+        The report stops when its iteration finishes or its ``close()``
+        method is called, or when used as a context manager, when the
+        context exits.
+
+        """
+        group = getattr(self, '_progress_group', None)
+        if group is None:
+            group = self._progress_group = _ProgressGroup(sys.stderr)
+        return _Progress(group, iterable, total=total, label=label, **kwargs)
+
+    def stream_table(self, labels, **kwargs):
+        """Return a new table that writes its rows to standard output as
+        they're added, instead of holding them all until printed.
+
+        Column widths are set with the `widths` keyword argument, or else
+        taken from the first `sample_rows` rows (100 by default), which are
+        held back until the widths are known. Cells too wide for their
+        columns are truncated, or wrapped onto more lines if `overflow` is
+        ``'wrap'``. If `spill` is true, rows are instead saved to a temporary
+        file and all written when the table is closed, sized to fit them all.
+
+        Use the table as a context manager, or call its `close()` method when
+        all the rows are added.
+
+        As with `table()`, if the user asked for a machine readable
+        ``--format``, the table writes its rows in that format instead.
+
+        """
+        kwargs.setdefault('out', sys.stdout)
+        if self.output_format != 'table':
+            return _RecordWriter(self.output_format, labels, out=kwargs['out'])
+        return _StreamingTable(labels, **kwargs)
+
+    def records(self, paths=None, encoding='utf-8'):
+        """Iterate over the lines of the files at `paths`, or of standard
+        input if no `paths` are given.
+
+        Each line is yielded as a string without its line ending. A path of
+        ``-`` means standard input, and gzipped files are decompressed. The
+        files are read in large chunks, so filter subcommands can process
+        their input quickly, writing their output with `emit()`.
+
+        """
+        if not paths:
+            paths = ['-']
+        for path in paths:
+            for lines in _read_records(path, encoding):
+                for record in lines:
+                    yield record
+
+    def emit(self, record):
+        """Write `record` to standard output as a line.
+
+        Strings are written as they are, and other records such as
+        dictionaries and lists are written as JSON. Lines are collected and
+        written together, every `emit_flush_lines` records and when the
+        subcommand finishes, or when `flush_records()` is called.
+
+        """
+        if not isinstance(record, _STRING_TYPES):
+            import json
+            record = json.dumps(record)
+
+        try:
+            emitted = self._emitted
+        except AttributeError:
+            emitted = self._start_emitting()
+        emitted.append(record)
+        if len(emitted) >= self._emit_flush_at:
+            self.flush_records()
+
+    def _start_emitting(self):
+        """Set up the list of records collected by `emit()`, returning it."""
+        flush_lines = self.emit_flush_lines
+        if flush_lines is None:
+            try:
+                isatty = sys.stdout.isatty()
+            except (AttributeError, ValueError):
+                isatty = False
+            flush_lines = 1 if isatty else 4096
+        self._emit_flush_at = flush_lines
+        self._emitted = list()
+        return self._emitted
+
+    def flush_records(self):
+        """Write out any records collected by `emit()`."""
+        emitted = getattr(self, '_emitted', None)
+        if not emitted:
+            return
+        # Other threads may be emitting into the same list, so take only the
+        # records already there.
+        with _emit_lock:
+            count = len(emitted)
+            if not count:
+                return
+            records = emitted[:count]
+            del emitted[:count]
+            sys.stdout.write('\n'.join(records) + '\n')
+            sys.stdout.flush()
+
+    def _user_config_path(self):
+        appname = type(self).__name__.lower()
+        return os.path.expanduser('~/.%s' % appname)
+
+    def _user_config_lock(self, filepath):
+        """Return a lock on the user's config file at `filepath`, whose lock
+        file is kept in termtool's cache directory rather than beside it."""
+        appname = type(self).__name__.lower()
+        return _FileLock(filepath, os.path.join(_cache_dir(), '%s.config.lock' % appname))
+
     def write_config_file(self, *args):
         """Write out a config file containing the given arguments.
 
@@ -120,37 +1996,231 @@ class Termtool(_TermtoolSuperclass):
 
         The arguments are written one per line to the ``~/.toolname`` file,
         where `toolname` is the name of the `Termtool` instance's class, in
-        lower case. The file is created if not present and overwritten if it
-        is. The file is opened with umask 077 so it is readable only by the
-        user invoking the tool (and whose home directory it's written to).
+        lower case. The file is created if not present and replaced if it is.
+        The file is readable only by the user invoking the tool (and whose
+        home directory it's written to), and is replaced all at once, so other
+        runs of the tool never read a partly written file.
 
         """
-        appname = type(self).__name__.lower()
-        filepath = os.path.expanduser('~/.%s' % appname)
+        # Replace the file a symlinked config file points to, not the link.
+        filepath = os.path.realpath(self._user_config_path())
+        contents = ''.join('%s\n' % arg for arg in args)
+        with self._user_config_lock(filepath):
+            _write_file_atomically(filepath, contents)
+
+    def _update_config_file(self, option, values):
+        """Replace the global `option` in the user's config file with the
+        list of `values`, or remove it if `values` is None."""
+        filepath = os.path.realpath(self._user_config_path())
+        with self._user_config_lock(filepath):
+            try:
+                with open(filepath, 'r') as config_file:
+                    lines = [line.strip('\n') for line in config_file.readlines()]
+            except IOError:
+                lines = list()
+
+            updated = list()
+            replaced = False
+            index = 0
+            while index < len(lines):
+                line = lines[index]
+                if line.startswith('[') and line.endswith(']') and len(line) > 2:
+                    # Leave subcommand sections alone, but add a new option
+                    # before them so it stays global.
+                    if values is not None and not replaced:
+                        updated.append(option)
+                        updated.extend(values)
+                        replaced = True
+                    updated.extend(lines[index:])
+                    break
+
+                if line == option or line.startswith(option + '='):
+                    # Skip the option and any values that followed it.
+                    index += 1
+                    if line == option:
+                        while index < len(lines) and not lines[index].startswith('-') and not (
+                                lines[index].startswith('[') and lines[index].endswith(']')):
+                            index += 1
+                    if values is not None and not replaced:
+                        updated.append(option)
+                        updated.extend(values)
+                        replaced = True
+                    continue
+
+                updated.append(line)
+                index += 1
+            else:
+                if values is not None and not replaced:
+                    updated.append(option)
+                    updated.extend(values)
+
+            _write_file_atomically(filepath, ''.join('%s\n' % line for line in updated))
 
-        # Don't let anybody else read the config file.
-        os.umask(0o077)
-        with open(filepath, 'w') as config_file:
-            for arg in args:
-                config_file.write(arg)
-                config_file.write('\n')
+    def set_config_option(self, option, *values):
+        """Save the global `option` with the given `values` in the user's
+        config file, replacing any values already saved for it.
+
+        Other arguments in the config file are left as they are. Options that
+        take no value, such as ``--no-color``, can be given with no `values`.
+        The file is locked while it's updated, so simultaneous updates by
+        other runs of the tool aren't lost.
+
+        """
+        self._update_config_file(option, list(values))
+
+    def unset_config_option(self, option):
+        """Remove the global `option` and its values from the user's config
+        file, leaving the file's other arguments as they are."""
+        self._update_config_file(option, None)
 
     def read_config_file(self):
         """Read the terminal user's config file for this tool.
 
         The config file is ``~/.toolname`` where `toolname` is the name of the
         `Termtool` instance's class, in lower case. The method returns a list
-        of config arguments as read from the file, one per line.
+        of config arguments as read from the file, one per line, leaving out
+        any sections for specific subcommands.
+
+        """
+        config_args, _ = _read_config_lines(self._user_config_path())
+        return config_args
+
+    def config_files(self):
+        """Return the paths of the config files that may configure this tool,
+        from lowest to highest precedence.
+
+        These are the system wide ``/etc/toolname`` file, the terminal user's
+        ``~/.toolname`` file, and then any ``.toolname`` files in the current
+        directory and its parents, the closest directory last. Not all of the
+        files need exist.
 
         """
         appname = type(self).__name__.lower()
-        filepath = os.path.expanduser('~/.%s' % appname)
-        if not os.path.exists(filepath):
-            return list()
+        filename = '.%s' % appname
+        user_filepath = os.path.expanduser(os.path.join('~', filename))
+        filepaths = [os.path.join(os.sep, 'etc', appname), user_filepath]
+
+        project_filepaths = list()
+        dirpath = os.getcwd()
+        while True:
+            filepath = os.path.join(dirpath, filename)
+            if filepath != user_filepath:
+                project_filepaths.append(filepath)
+            parent = os.path.dirname(dirpath)
+            if parent == dirpath:
+                break
+            dirpath = parent
+
+        filepaths.extend(reversed(project_filepaths))
+        return filepaths
+
+    def read_config(self):
+        """Read all the tool's config files.
+
+        Returns a list of the global arguments from all the `config_files()`,
+        in order of precedence, and a dictionary of lists of arguments for
+        specific subcommands, keyed on subcommand name.
+
+        Config files contain arguments one per line. Arguments after a line
+        with a subcommand name in brackets, such as ``[frob]``, are used only
+        when running that subcommand. The global arguments of the user's own
+        config file are read with `read_config_file()`. Files are only read
+        again after they change.
 
-        with open(filepath, 'r') as config_file:
-            config_args = [line.strip('\n') for line in config_file.readlines()]
-        return config_args
+        """
+        config_args, config_sections = list(), dict()
+        user_filepath = self._user_config_path()
+        for filepath in self.config_files():
+            file_args, file_sections = _read_config_lines(filepath)
+            if filepath == user_filepath:
+                # Let tools that read their user config their own way keep
+                # doing so.
+                file_args = self.read_config_file()
+            config_args.extend(file_args)
+            for name, section_args in file_sections.items():
+                config_sections.setdefault(name, list()).extend(section_args)
+        return config_args, config_sections
+
+    def config_env_args(self, parser):
+        """Return arguments for the global options of `parser` that are set
+        with environment variables.
+
+        The variable for an option is the tool name and the option's name in
+        upper case, joined by an underscore, with dashes also replaced by
+        underscores: ``TOOLNAME_ACCESS_TOKEN`` sets ``--access-token``.
+        Options that take no values, such as ``--no-color``, are given when
+        their variables are set to ``1``, ``true`` or ``yes``. Termtool's own
+        options, such as ``--profile`` and ``--batch``, can't be set this
+        way.
+
+        """
+        prefix = '%s_' % type(self).__name__.upper()
+        env_args = list()
+        for key in sorted(os.environ):
+            if not key.startswith(prefix):
+                continue
+            option = '--%s' % key[len(prefix):].lower().replace('_', '-')
+            action = parser._option_string_actions.get(option)
+            # Termtool's own options can only be given on the command line.
+            if action is None or action.dest.startswith('_termtool_'):
+                continue
+            value = os.environ[key]
+            if action.nargs == 0:
+                if value.lower() in ('1', 'true', 'yes'):
+                    env_args.append(option)
+            else:
+                env_args.extend([option, value])
+        return env_args
+
+    def _config_arguments(self, parser, config_args, config_sections, argv):
+        """Combine the config arguments, the environment arguments and the
+        command line arguments `argv` into the arguments for `parser` to
+        parse, placing any config section arguments for the invoked
+        subcommand after the subcommand."""
+        config_args = self._without_termtool_options(parser, config_args)
+        args = config_args + self.config_env_args(parser) + argv
+        if not config_sections:
+            return args
+
+        names = self._command_names()
+        index = self._find_subcommand(args, parser, names)
+        if index is None:
+            return args
+
+        name = args[index]
+        # Look up sections by the real subcommand name, should this be an alias.
+        canonical = names[name]
+        section_args = config_sections.get(canonical, list())
+        if name != canonical:
+            section_args = section_args + config_sections.get(name, list())
+        for action in parser._actions:
+            if isinstance(action, argparse._SubParsersAction) and canonical in action.choices:
+                section_args = self._without_termtool_options(action.choices[canonical], section_args)
+        return args[:index + 1] + section_args + args[index + 1:]
+
+    def _without_termtool_options(self, parser, config_args):
+        """Return the arguments `config_args` from config files without any of
+        termtool's own options for `parser`, which can only be given on the
+        command line."""
+        kept = list()
+        option_actions = parser._option_string_actions
+        index = 0
+        while index < len(config_args):
+            arg = config_args[index]
+            index += 1
+            option = arg.split('=', 1)[0] if arg.startswith('--') else arg
+            action = option_actions.get(option)
+            if action is None or not action.dest.startswith('_termtool_'):
+                kept.append(arg)
+                continue
+
+            logging.getLogger('termtool').warning('Ignoring %s in config file; it can only be given on the '
+                'command line', option)
+            if option == arg and isinstance(action.nargs, int):
+                index += action.nargs
+            elif option == arg and action.nargs is None:
+                index += 1
+        return kept
 
     class _LogLevelAddAction(argparse.Action):
 
@@ -174,78 +2244,416 @@ class Termtool(_TermtoolSuperclass):
             else:
                 setattr(namespace, self.dest, level)
 
-    def build_arg_parser(self):
-        """Build and return the `argparse.ArgumentParser` instance suitable for
-        parsing arguments for this `Termtool` instance.
+    def _build_global_parser(self, spec, suppress_defaults=False):
+        """Build the parent parser holding the global options valid both
+        before and after the subcommand.
 
-        The instance's subcommands and arguments are evaluated, with the
-        subcommands added as subparsers. The `ArgumentParser` also supports
-        ``-v`` and ``-q`` options for controlling the `logging` module log
-        level.
+        If `suppress_defaults` is true, the options have no defaults, so that
+        when the parser is used for a subcommand the global options given
+        before the subcommand aren't reset.
 
         """
-        # Arguments after the subcommand are parsed by the subparser only, so
-        # specify the global options in a parent parser so they're valid both
-        # before and after the subcommand.
         global_parser = argparse.ArgumentParser(add_help=False)
-        global_parser.set_defaults(loglevel=logging.WARNING)
+        if not suppress_defaults:
+            global_parser.set_defaults(loglevel=logging.WARNING)
         global_parser.add_argument('-v', dest='loglevel', action=self._LogLevelAddAction, const=1, help='be more verbose (stackable)')
         global_parser.add_argument('-q', dest='loglevel', action=self._LogLevelAddAction, const=-1, help='be less verbose (stackable)')
         global_parser.add_argument('--no-color', dest='color', action='store_false', help='use no color in log')
 
-        try:
-            class_arguments = self._arguments
-        except AttributeError:
-            pass
-        else:
-            # Add arguments in the order they were declared.
-            for arg_args, arg_kwargs in reversed(class_arguments):
-                global_parser.add_argument(*arg_args, **arg_kwargs)
-
+        for arg_args, arg_kwargs in spec['arguments']:
+            global_parser.add_argument(*arg_args, **arg_kwargs)
+
+        if suppress_defaults:
+            for action in global_parser._actions:
+                if action.option_strings:
+                    action.default = argparse.SUPPRESS
+
+        return global_parser
+
+    def _add_run_options(self, parser):
+        """Add termtool's options for controlling the whole run to the
+        top level `parser`, where they're given before the subcommand."""
+        _add_termtool_option(parser, '--log-json', dest='_termtool_log_json', action='store_true',
+            help='log as lines of JSON')
+        _add_termtool_option(parser, '--log-async', dest='_termtool_log_async', action='store_true',
+            help='write log messages from a background thread')
+        _add_termtool_option(parser, '--format', dest='_termtool_format',
+            choices=('table',) + _RecordWriter.FORMATS, help='format of displayed tables (default: table)')
+        _add_termtool_option(parser, '--jobs', dest='_termtool_jobs', type=int, metavar='N',
+            help='run parallel commands and batch lines with N workers (default: based on CPU count)')
+        _add_termtool_option(parser, '--concurrency', dest='_termtool_concurrency', type=int, metavar='N',
+            help='size of the semaphore shared by async commands (default: 100)')
+        _add_termtool_option(parser, '--profile', dest='_termtool_profile', action='store_true',
+            help='profile the command, printing the slowest functions')
+        _add_termtool_option(parser, '--profile-file', dest='_termtool_profile_file', metavar='FILE',
+            help='profile the command, saving the profile to FILE')
+        _add_termtool_option(parser, '--timings', dest='_termtool_timings', action='store_true',
+            help='report the time spent in each step of the run')
+        _add_termtool_option(parser, '--timeout', dest='_termtool_timeout', type=float, metavar='SECONDS',
+            help='stop the command if it runs longer than SECONDS (exit code %d)' % self.EXIT_TIMEOUT)
+        _add_termtool_option(parser, '--max-cpu', dest='_termtool_max_cpu', type=float, metavar='SECONDS',
+            help='stop the command if it uses more than SECONDS of CPU time (exit code %d)' % self.EXIT_CPU_LIMIT)
+        _add_termtool_option(parser, '--max-rss', dest='_termtool_max_rss', type=_parse_size, metavar='SIZE',
+            help='stop the command if it uses more than SIZE bytes (or K, M, G) of memory (exit code %d)'
+            % self.EXIT_MEMORY_LIMIT)
+        _add_termtool_option(parser, '--metrics', dest='_termtool_metrics', metavar='SINK',
+            help='send metrics about the run to SINK (statsd://HOST:PORT, prometheus:PATH or jsonl:PATH)')
+        _add_termtool_option(parser, '--batch', dest='_termtool_batch', metavar='FILE',
+            help='run the commands in FILE (or - for stdin), one per line')
+        _add_termtool_option(parser, '--resume', dest='_termtool_resume', action='store_true',
+            help='continue the interrupted run of the command or batch with the same arguments')
+
+    def _subcommand_run_options(self, command):
+        """Return the names of termtool's subcommand options that apply to
+        the subcommand method `command`."""
+        # Like -v and -q, --format can be given on either side of the
+        # subcommand, for subcommands that make tables in helper methods too.
+        options = set(self.subcommand_options)
+        options.add('format')
+        if _is_coroutine_function(command):
+            options.add('concurrency')
+        elif _subcommand_option(command, 'parallel') is not None:
+            options.add('jobs')
+        if _subcommand_option(command, 'cache_ttl') is not None:
+            options.add('cache')
+        names = _code_names(command)
+        if 'checkpoint' in names or 'restore' in names:
+            options.add('resume')
+        return [name for name in _SUBCOMMAND_RUN_OPTIONS if name in options]
+
+    def _add_subcommand_run_options(self, parser, options):
+        """Add termtool's subcommand options named in `options` to the
+        subcommand `parser`, skipping any the subcommand already has."""
+        # The options have no defaults, so they don't replace the values of
+        # the same options given before the subcommand.
+        if 'format' in options:
+            _add_termtool_option(parser, '--format', dest='_termtool_format', default=argparse.SUPPRESS,
+                choices=('table',) + _RecordWriter.FORMATS, help='format of displayed tables (default: table)')
+        if 'jobs' in options:
+            _add_termtool_option(parser, '--jobs', dest='_termtool_jobs', type=int, metavar='N',
+                default=argparse.SUPPRESS, help='run with N workers (default: based on CPU count)')
+        if 'concurrency' in options:
+            _add_termtool_option(parser, '--concurrency', dest='_termtool_concurrency', type=int, metavar='N',
+                default=argparse.SUPPRESS, help='size of the semaphore shared by async commands (default: 100)')
+        if 'cache' in options:
+            _add_termtool_option(parser, '--no-cache', dest='_termtool_cache', action='store_false',
+                default=argparse.SUPPRESS, help='run without using or saving cached output')
+            _add_termtool_option(parser, '--refresh', dest='_termtool_refresh', action='store_true',
+                default=argparse.SUPPRESS, help='run and save the output, ignoring cached output')
+        if 'resume' in options:
+            _add_termtool_option(parser, '--resume', dest='_termtool_resume', action='store_true',
+                default=argparse.SUPPRESS, help='continue the interrupted run of the command with the same arguments')
+
+    def _add_subcommand_parser(self, subparsers, global_parser, command_spec, command):
+        """Add a subparser for the subcommand described by `command_spec` to
+        `subparsers`, invoking the `command` method when used."""
+        subparser = subparsers.add_parser(command_spec['name'], parents=[global_parser],
+            **command_spec['kwargs'])
+
+        # Set the subparser's func so it becomes this command (callable)
+        # when the user invokes this subparser.
+        subparser.set_defaults(func=command)
+
+        for arg_args, arg_kwargs in command_spec['arguments']:
+            subparser.add_argument(*arg_args, **arg_kwargs)
+        self._add_subcommand_run_options(subparser, command_spec.get('options', ()))
+
+    def _parser_spec(self, names=None):
+        """Collect the tool's description, global arguments and subcommands
+        from its decorated methods into a dictionary describing the parser to
+        build. If `names` is given, only the subcommands of those names are
+        described."""
         try:
             description = self.description
         except AttributeError:
             description = self.__doc__
-        parser = argparse.ArgumentParser(description=description, parents=[global_parser])
-        parser.set_defaults(subcommand='help')
 
-        subparsers = parser.add_subparsers(dest='subcommand', title='subcommands', metavar='')
+        # Arguments are listed in the order they were declared, which is the
+        # reverse of the order the decorators ran.
+        spec = {
+            'description': description,
+            'arguments': [[list(arg_args), arg_kwargs] for arg_args, arg_kwargs
+                in reversed(getattr(self, '_arguments', ()))],
+            'subcommands': [],
+        }
 
         # Add all the subcommands in asciibetical order by command name.
-        for command in sorted(self._subcommands, key=lambda c: c._subcommand[0]):
-            name, about_kwargs = command._subcommand
-            try:
-                description = about_kwargs.pop('description')
-            except KeyError:
-                description = command.__doc__
-            subparser = subparsers.add_parser(name, parents=[global_parser],
-                description=description, **about_kwargs)
+        for name, command in self._subcommands_by_name.items():
+            if names is None or name in names:
+                spec['subcommands'].append(self._subcommand_spec(name, command))
+
+        return spec
+
+    def _subcommand_spec(self, name, command):
+        """Describe the subparser for the subcommand function `command`."""
+        # Copy the settings so the decorator's copy keeps its description.
+        about_kwargs = dict(command._subcommand[1])
+        about_kwargs.setdefault('description', command.__doc__)
+        return {
+            'name': name,
+            'kwargs': about_kwargs,
+            'arguments': [[list(arg_args), arg_kwargs] for arg_args, arg_kwargs
+                in reversed(getattr(command, '_arguments', ()))],
+            'options': self._subcommand_run_options(command),
+        }
+
+    def _plugin_manifest_key(self):
+        """Return a value that changes when packages are installed, upgraded
+        or removed.
 
-            # Set the subparser's func so it becomes this command (callable)
-            # when the user invokes this subparser.
-            subparser.set_defaults(func=command)
+        The key lists the package metadata directories (named for the package
+        and its version) in each directory on `sys.path`, which is much
+        cheaper than importing all the plugins to see what they are.
 
+        """
+        paths = list()
+        for path in sys.path:
             try:
-                arguments = command._arguments
-            except AttributeError:
-                pass
+                filenames = os.listdir(path or os.curdir)
+            except OSError:
+                continue
+            paths.append([path, sorted(filename for filename in filenames
+                if filename.endswith(('.dist-info', '.egg-info', '.egg-link', '.pth')))])
+        return [__version__, self.plugin_group, paths]
+
+    def _build_plugin_manifest(self):
+        """Import all the plugins in the tool's `plugin_group` and describe
+        their subcommands."""
+        manifest = list()
+        for name, target in _iter_entry_points(self.plugin_group):
+            if name in self._subcommands_by_name:
+                continue
+            command = self._load_plugin(name, target)
+            if command is None:
+                continue
+            about_kwargs = getattr(command, '_subcommand', (None, {}))[1]
+            manifest.append({
+                'name': name,
+                'target': target,
+                'kwargs': dict((key, about_kwargs[key]) for key in ('help', 'aliases')
+                    if key in about_kwargs),
+            })
+        manifest.sort(key=lambda plugin: plugin['name'])
+        return manifest
+
+    def _load_plugin(self, name, target):
+        """Import the plugin subcommand `name` from the entry point `target`,
+        returning ``None`` with a logged warning if it can't be used."""
+        log = logging.getLogger('termtool')
+        try:
+            command = _load_entry_point(target)
+        except Exception:
+            log.warning("Couldn't load plugin subcommand %r from %s", name, target, exc_info=True)
+            return None
+        if not callable(command) or not hasattr(command, '_subcommand'):
+            log.warning("Skipping plugin subcommand %r from %s, which isn't decorated with "
+                "@subcommand", name, target)
+            return None
+        return command
+
+    def _plugin_manifest(self):
+        """Return a list describing the tool's plugin subcommands, from the
+        manifest in the user's cache directory when it's up to date."""
+        if not self.plugin_group:
+            return []
+        try:
+            return self._plugins
+        except AttributeError:
+            pass
+
+        import json
+        appname = type(self).__name__.lower()
+        filepath = os.path.join(_cache_dir(), '%s.plugins.json' % appname)
+        key = self._plugin_manifest_key()
+        try:
+            with open(filepath, 'r') as cache_file:
+                cached = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            cached = {}
+
+        if cached.get('key') == key:
+            manifest = cached['plugins']
+        else:
+            manifest = self._build_plugin_manifest()
+            if _is_plain_data(manifest):
+                try:
+                    _write_file_atomically(filepath, json.dumps({'key': key, 'plugins': manifest}))
+                except (IOError, OSError):
+                    pass
+
+        # Subcommands of the tool itself win over plugins of the same name,
+        # and plugins can't take names already in use as aliases.
+        self._plugins = list()
+        taken = set(self._subcommand_names)
+        taken.update(plugin['name'] for plugin in manifest)
+        for plugin in manifest:
+            if plugin['name'] in self._subcommands_by_name:
+                continue
+            if 'aliases' in plugin['kwargs']:
+                aliases = [alias for alias in plugin['kwargs']['aliases'] if alias not in taken]
+                taken.update(aliases)
+                plugin = dict(plugin, kwargs=dict(plugin['kwargs'], aliases=aliases))
+            self._plugins.append(plugin)
+        return self._plugins
+
+    def _command_names(self):
+        """Return a dictionary mapping the names and aliases of all the tool's
+        subcommands, including plugins, to their subcommand names."""
+        names = dict(self._subcommand_names)
+        for plugin in self._plugin_manifest():
+            names.setdefault(plugin['name'], plugin['name'])
+            for alias in plugin['kwargs'].get('aliases', ()):
+                names.setdefault(alias, plugin['name'])
+        return names
+
+    def _find_subcommand(self, argv, parser, commands):
+        """Peek at `argv` to find which of `commands` the user is invoking.
+
+        Returns the index of the subcommand name in `argv`, or ``None`` if it
+        can't be told without parsing the arguments for real: when help was
+        requested, when the first positional argument is not a subcommand, or
+        when a global option takes a variable number of values. `parser` is
+        the parser for the global options, which may also have the
+        subcommands.
+
+        """
+        if any(action.option_strings == [] and not isinstance(action, argparse._SubParsersAction)
+                for action in parser._actions):
+            # Global positional arguments come before the subcommand.
+            return None
+
+        option_actions = parser._option_string_actions
+        index = 0
+        while index < len(argv):
+            arg = argv[index]
+            index += 1
+            if arg in ('-h', '--help', '--'):
+                return None
+            if not arg.startswith('-') or arg == '-':
+                return index - 1 if arg in commands else None
+            action = option_actions.get(arg)
+            if action is None and arg.startswith('--'):
+                if '=' not in arg:
+                    return None
+                if arg.split('=', 1)[0] not in option_actions:
+                    return None
+                continue
+            elif action is None:
+                # Walk stacked short options (``-vvq``) until one takes a
+                # value, which is either attached (``-ofoo``) or next.
+                for i, char in enumerate(arg[1:], 2):
+                    action = option_actions.get('-' + char)
+                    if action is None:
+                        return None
+                    if action.nargs != 0:
+                        break
+                if action.nargs == 0 or i < len(arg):
+                    continue
+
+            nargs = action.nargs
+            if nargs is None:
+                nargs = 1
+            if not isinstance(nargs, int):
+                return None
+            index += nargs
+
+        return None
+
+    def build_arg_parser(self, argv=None):
+        """Build and return the `argparse.ArgumentParser` instance suitable for
+        parsing arguments for this `Termtool` instance.
+
+        The instance's subcommands and arguments are evaluated, with the
+        subcommands added as subparsers. The `ArgumentParser` also supports
+        ``-v`` and ``-q`` options for controlling the `logging` module log
+        level.
+
+        If the instance's `lazy_arg_parser` attribute is true and the command
+        line arguments to be parsed are given as `argv`, only the subparser
+        for the subcommand named in `argv` is built. The whole parser is still
+        built if `argv` asks for help or names no known subcommand, so usage
+        and error messages list all the subcommands. `main()` only passes
+        `argv` to tools overriding this method if their method takes it too.
+
+        """
+        # Describe no subcommands yet, until we know which are needed.
+        spec = self._parser_spec(names=())
+
+        # Arguments after the subcommand are parsed by the subparser only, so
+        # specify the global options in a parent parser so they're valid both
+        # before and after the subcommand.
+        global_parser = self._build_global_parser(spec)
+        subcommand_global_parser = self._build_global_parser(spec, suppress_defaults=True)
+
+        parser = argparse.ArgumentParser(description=spec['description'], parents=[global_parser])
+        parser.set_defaults(subcommand='help')
+        self._add_run_options(parser)
+
+        subparsers = parser.add_subparsers(dest='subcommand', title='subcommands', metavar='')
+
+        commands = self._subcommands_by_name
+        wanted = None
+        plugins = self._plugin_manifest()
+        names = self._command_names()
+        invoked = None
+        if argv is not None and (self.lazy_arg_parser or plugins):
+            index = self._find_subcommand(argv, parser, names)
+            if index is not None:
+                invoked = names[argv[index]]
+                if self.lazy_arg_parser:
+                    wanted = (invoked,)
+                    plugins = [plugin for plugin in plugins if plugin['name'] == invoked]
+
+        # Only describe the subcommands getting subparsers, which for a lazy
+        # parser is just the one invoked.
+        command_specs = [self._subcommand_spec(name, command) for name, command in commands.items()
+            if wanted is None or name in wanted]
+        entries = [(command_spec['name'], command_spec, None) for command_spec in command_specs]
+        if plugins:
+            entries.extend((plugin['name'], None, plugin) for plugin in plugins)
+            entries.sort(key=lambda entry: entry[0])
+
+        for name, command_spec, plugin in entries:
+            if plugin is None:
+                self._add_subcommand_parser(subparsers, subcommand_global_parser, command_spec,
+                    commands[name])
+            # Import only the plugins that may be run, so help lists all the
+            # plugins from the manifest without importing any of them. When
+            # the subcommand can't be told from the arguments, load any
+            # plugins they mention.
+            elif argv is None or name == invoked or (invoked is None and any(
+                    names.get(arg) == name for arg in argv)):
+                command = self._load_plugin(name, plugin['target'])
+                if command is None:
+                    continue
+                command_spec = self._subcommand_spec(plugin['name'], command)
+                command_spec['kwargs'].update(plugin['kwargs'])
+                self._add_subcommand_parser(subparsers, subcommand_global_parser, command_spec,
+                    command)
             else:
-                # Add arguments in the order they were declared.
-                for arg_args, arg_kwargs in reversed(arguments):
-                    subparser.add_argument(*arg_args, **arg_kwargs)
+                subparsers.add_parser(plugin['name'], **plugin['kwargs'])
 
         return parser
 
     class _NoColorLogFormatter(logging.Formatter):
 
-        STRIP_COLOR = re.compile(r'\033\[[^m]+m')
-        """The compiled regular expression to remove ANSI color codes from a string."""
+        COLOR_TOKENS = re.compile(r'%\((?:levelcolor|resetcolor)\)[-#0 +]*\d*(?:\.\d+)?s')
+        """The compiled regular expression matching the color tokens in a log format."""
+
+        def __init__(self, fmt=None, datefmt=None):
+            # The color tokens are always empty, so take them out once here.
+            if fmt is not None:
+                fmt = self.COLOR_TOKENS.sub('', fmt)
+            super(Termtool._NoColorLogFormatter, self).__init__(fmt, datefmt)
 
         def format(self, record):
+            # Other handlers of the record may still use the color tokens.
             record.levelcolor = ''
             record.resetcolor = ''
             logline = super(Termtool._NoColorLogFormatter, self).format(record)
-            return self.STRIP_COLOR.sub('', logline)
+            if '\033' in logline:
+                logline = _STRIP_COLOR.sub('', logline)
+            return logline
 
     class _ColorLogFormatter(logging.Formatter):
 
@@ -257,12 +2665,55 @@ class Termtool(_TermtoolSuperclass):
             logging.CRITICAL: '35',  # magenta
         }
 
+        def __init__(self, fmt=None, datefmt=None):
+            super(Termtool._ColorLogFormatter, self).__init__(fmt, datefmt)
+            self.log_format = fmt
+            self.formatter_for_level = dict()
+
+        def _formatter_for_level(self, levelno):
+            """Make a formatter for records at level `levelno`, with the
+            level's color codes filled into the log format, and return it
+            with the level's color code."""
+            color = self.color_for_level.get(levelno)
+            levelcolor = '\033[1;%sm' % color if color is not None else ''
+            fmt = self.log_format
+            if fmt is not None:
+                fmt = fmt.replace('%(levelcolor)s', levelcolor).replace('%(resetcolor)s', '\033[0m')
+            self.formatter_for_level[levelno] = logging.Formatter(fmt, self.datefmt), levelcolor
+            return self.formatter_for_level[levelno]
+
         def format(self, record):
-            color = self.color_for_level.get(record.levelno)
-            if color is not None:
-                record.levelcolor = '\033[1;%sm' % color
+            try:
+                formatter, levelcolor = self.formatter_for_level[record.levelno]
+            except KeyError:
+                formatter, levelcolor = self._formatter_for_level(record.levelno)
+            # Other handlers of the record may still use the color tokens.
+            record.levelcolor = levelcolor
             record.resetcolor = '\033[0m'
-            return super(Termtool._ColorLogFormatter, self).format(record)
+            return formatter.format(record)
+
+    class _JSONLogFormatter(logging.Formatter):
+
+        """A log formatter that formats each record as a line of JSON."""
+
+        def __init__(self, fmt=None, datefmt=None):
+            super(Termtool._JSONLogFormatter, self).__init__(fmt, datefmt)
+            import json
+            self.encoder = json.JSONEncoder(default=str)
+
+        def format(self, record):
+            message = record.getMessage()
+            if '\033' in message:
+                message = _STRIP_COLOR.sub('', message)
+            data = {
+                'time': record.created,
+                'level': record.levelname,
+                'logger': record.name,
+                'message': message,
+            }
+            if record.exc_info:
+                data['exception'] = self.formatException(record.exc_info)
+            return self.encoder.encode(data)
 
     def configure_tool(self, args):
         """Configure the tool according to the command line arguments.
@@ -285,29 +2736,95 @@ class Termtool(_TermtoolSuperclass):
         Color is enabled if stderr is a terminal and the ``--no-color`` option
         was not provided.
 
+        If the instance's `log_json` attribute is true or the ``--log-json``
+        option was provided, each log record is instead formatted as a line
+        of JSON, and `log_format` is not used.
+
+        If the instance's `log_async` attribute is true or the ``--log-async``
+        option was provided, log records are queued and written to stderr in
+        batches by a background thread, so logging never waits on a slow
+        stderr. `main()` writes out any queued records before returning.
+
+        Configuring the tool again replaces the handler added the last time.
+
+        The tool's `output_format` is also set from the ``--format`` option.
+
         """
+        self.output_format = getattr(args, '_termtool_format', None) or type(self).output_format
+
         log_level = args.loglevel
         root_logger = logging.getLogger()
         root_logger.setLevel(log_level)
 
+        # Replace the handlers from any earlier configuration instead of
+        # logging everything twice.
+        self._stop_log_listener()
+        for old_handler in list(root_logger.handlers):
+            if getattr(old_handler, '_termtool', False):
+                root_logger.removeHandler(old_handler)
+
         log_format = self.log_format
         handler = logging.StreamHandler()  # using sys.stderr
-        if args.color and hasattr(sys.stderr, 'isatty') and sys.stderr.isatty():
+        handler._termtool = True
+        if self.log_json or getattr(args, '_termtool_log_json', False):
+            formatter_class = self._JSONLogFormatter
+        elif args.color and hasattr(sys.stderr, 'isatty') and sys.stderr.isatty():
             formatter_class = self._ColorLogFormatter
         else:
             formatter_class = self._NoColorLogFormatter
         handler.setFormatter(formatter_class(log_format))
-        root_logger.addHandler(handler)
+        if self.log_async or getattr(args, '_termtool_log_async', False):
+            self._start_log_listener(handler)
+        else:
+            root_logger.addHandler(handler)
 
         logging.info('Set log level to %s', logging.getLevelName(log_level))
 
+    def _start_log_listener(self, handler):
+        """Log through a queue to a background thread that writes records
+        to `handler` in batches."""
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        from logging.handlers import QueueHandler
+
+        log_queue = queue.Queue()
+        queue_handler = QueueHandler(log_queue)
+        queue_handler._termtool = True
+        self._log_listener = _BatchingLogListener(log_queue, handler)
+        self._log_listener.start()
+        logging.getLogger().addHandler(queue_handler)
+
+    def _stop_log_listener(self):
+        """Write out any queued log records and stop the background log
+        thread, if it's running.
+
+        Records logged after this go straight to the handler the thread was
+        writing to.
+
+        """
+        listener = getattr(self, '_log_listener', None)
+        if listener is None:
+            return
+        self._log_listener = None
+
+        root_logger = logging.getLogger()
+        for old_handler in list(root_logger.handlers):
+            if getattr(old_handler, 'queue', None) is listener.queue:
+                root_logger.removeHandler(old_handler)
+        listener.stop()
+        root_logger.addHandler(listener.handler)
+
     def main(self, argv):
         """Perform the tool's functions, given the specified command line
         arguments.
 
-        This method reads the instance's config file with the
-        `read_config_file()` method, adds the arguments specified in `argv`,
-        and performs the subcommand identified there.
+        This method reads the instance's config files with the
+        `read_config()` method, adds arguments set in environment variables
+        (see `config_env_args()`) and the arguments specified in `argv`, and
+        performs the subcommand identified there. Arguments from config file
+        sections for that subcommand are added after the subcommand name.
 
         The method returns an integer exit code suitable for using with
         `sys.exit()`. That is, `main()` returns ``0`` if the subcommand
@@ -317,29 +2834,828 @@ class Termtool(_TermtoolSuperclass):
         specified, the process is terminated by `argparse` instead and `main()`
         will not return.
 
+        For `parallel` subcommands, the exit code is the number of values
+        the subcommand failed for (up to 100), as well as ``1`` if
+        interrupted. Values whose work hasn't started when the subcommand is
+        interrupted are skipped.
+
+        With the ``--timeout``, ``--max-cpu`` and ``--max-rss`` options, the
+        subcommand is stopped if it runs too long or uses too much CPU time
+        or memory, and the exit code is the tool's `EXIT_TIMEOUT`,
+        `EXIT_CPU_LIMIT` or `EXIT_MEMORY_LIMIT` respectively. If the program
+        reading the tool's output exits early, the exit code is
+        `EXIT_BROKEN_PIPE`.
+
+        The time taken by each step of the run is recorded in the instance's
+        `timings` attribute, and reported to stderr if the ``--timings``
+        option is given. With the ``--profile`` or ``--profile-file`` option,
+        the subcommand is run under `cProfile`.
+
         """
-        config_args = self.read_config_file()
+        start = _wall_clock()
+        self.timings = OrderedDict()
+        self._limit_exceeded = None
+
+        config_args, config_sections = self._time_phase('read_config_file', self.read_config)
         args = config_args + argv
 
-        parser = self.build_arg_parser()
-        args = parser.parse_args(args)
+        parser = getattr(self, '_warm_parser', None)
+        if parser is None:
+            if _takes_argv(self.build_arg_parser):
+                parser = self._time_phase('build_arg_parser', self.build_arg_parser, args)
+            else:
+                # Tools may override build_arg_parser() without the argument.
+                parser = self._time_phase('build_arg_parser', self.build_arg_parser)
+        args = self._config_arguments(parser, config_args, config_sections, argv)
+        args = self._time_phase('parse_args', parser.parse_args, args)
+
+        self._time_phase('configure_tool', self.configure_tool, args)
+        self._run_args = args
+        self._checkpoints = None
+
+        run = self._run_subcommand
+        if getattr(args, '_termtool_batch', None) is not None:
+            run = lambda args: self._run_batch(parser, config_sections, args)
+
+        metrics_sink = getattr(args, '_termtool_metrics', None) or self.metrics_sink
+        if metrics_sink:
+            self.metrics = _Metrics()
+        else:
+            self.__dict__.pop('metrics', None)
+
+        profile_file = getattr(args, '_termtool_profile_file', None)
+        profile = getattr(args, '_termtool_profile', False) or profile_file is not None
+        # Read the limits only from termtool's own options, not any options
+        # of the tool that happen to be named the same.
+        limits = _ResourceLimits(getattr(args, '_termtool_timeout', None),
+            getattr(args, '_termtool_max_cpu', None), getattr(args, '_termtool_max_rss', None))
+        # An uncaught error ends the process with exit code 1.
+        status = 1
+        try:
+            try:
+                with limits:
+                    if profile:
+                        status = self._time_phase('subcommand', self._profile_subcommand, run, args, profile_file)
+                    else:
+                        status = self._time_phase('subcommand', run, args)
+            finally:
+                self.flush_records()
+        except KeyboardInterrupt:
+            status = 1
+        except _LimitExceeded as exc:
+            status = self._report_limit_exceeded(args, exc.limit)
+        except IOError as exc:
+            # Stop quietly when the program reading our output exits, as
+            # with `tool frob | head`.
+            if exc.errno != errno.EPIPE:
+                raise
+            self._discard_output()
+            status = self.EXIT_BROKEN_PIPE
+        finally:
+            self._finish_checkpoints(args, status)
+            if metrics_sink:
+                self._send_metrics(metrics_sink, args, status, _wall_clock() - start)
+            self._stop_log_listener()
+            if getattr(args, '_termtool_timings', False):
+                self._report_timings()
+        return status
+
+    def _send_metrics(self, sink, args, status, duration):
+        """Send the metrics of the run of `args` to `sink`, without letting
+        any problem sending them fail the run."""
+        if getattr(args, '_termtool_batch', None) is not None:
+            name = 'batch'
+        else:
+            name = self._command_names().get(args.subcommand, args.subcommand)
+        record = OrderedDict((
+            ('time', time.time()),
+            ('tool', type(self).__name__.lower()),
+            ('subcommand', name),
+            ('duration', duration),
+            ('exit_code', status),
+            ('peak_rss', _peak_rss()),
+            ('counters', dict(self.metrics.counters)),
+            ('gauges', dict(self.metrics.gauges)),
+        ))
+        try:
+            _send_metrics_record(sink, record)
+        except Exception as exc:
+            logging.getLogger('termtool').warning('Could not send metrics to %s: %s', sink, exc)
+
+    def _run_checkpoints(self):
+        """Return the checkpoints of the current run, reading the state
+        saved by an earlier run if resuming."""
+        checkpoints = self._checkpoints
+        if checkpoints is None:
+            args = self._run_args
+            appname = type(self).__name__.lower()
+            batch = getattr(args, '_termtool_batch', None)
+            if args is None:
+                run_key = 'default'
+            elif batch is not None:
+                # The lines of a batch share the checkpoints of the batch.
+                run_key = self._run_key(args, batch if batch == '-' else os.path.abspath(batch))
+            else:
+                run_key = self._run_key(args)
+            filepath = os.path.join(_state_dir(), '%s.checkpoints' % appname, '%s.json' % run_key)
+            checkpoints = self._checkpoints = _Checkpoints(filepath, self.checkpoint_interval,
+                getattr(args, '_termtool_resume', False))
+        return checkpoints
+
+    def checkpoint(self, key, state):
+        """Save `state` as the progress of the current run under `key`.
+
+        If the run is interrupted or fails, running the tool again with the
+        same arguments and the ``--resume`` option makes the state available
+        from `restore()`, so the subcommand can skip the work it already
+        did. The state should be made of values JSON can represent, and
+        should not be changed after it's checkpointed (checkpoint a new value
+        instead).
+
+        Checkpointing is cheap: the state is written to disk at most every
+        `checkpoint_interval` seconds, and when the run ends without
+        succeeding. When the run succeeds, the saved state is removed.
+
+        """
+        (self._checkpoints or self._run_checkpoints()).set(key, state)
+
+    def restore(self, key, default=None):
+        """Return the state checkpointed under `key` by an earlier run with
+        the same arguments, if the ``--resume`` option was given, or else
+        `default`."""
+        return self._run_checkpoints().restored.get(key, default)
+
+    def _finish_checkpoints(self, args, status):
+        """Remove the checkpoints of a run that succeeded, or make sure those
+        of one that didn't are saved."""
+        checkpoints = self._checkpoints
+        if checkpoints is None:
+            return
+        self._checkpoints = None
+        if status == 0:
+            checkpoints.discard()
+            return
+        if getattr(args, '_termtool_batch', None) is not None:
+            name = 'the batch'
+        else:
+            name = args.subcommand
+        try:
+            saved = checkpoints.flush()
+        except (IOError, OSError) as exc:
+            logging.error('Could not save the progress of %s: %s', name, exc)
+            return
+        if saved:
+            logging.warning('Saved the progress of %s; run it again with --resume to continue', name)
+
+    def _report_limit_exceeded(self, args, limit):
+        """Log that the run of `args` exceeded its resource `limit`, and
+        return the exit code for that limit."""
+        self._limit_exceeded = limit
+        name = getattr(args, 'subcommand', None) or 'command'
+        if limit == 'timeout':
+            logging.error('Stopped %s after it ran longer than %s seconds (--timeout)', name, args._termtool_timeout)
+            return self.EXIT_TIMEOUT
+        if limit == 'cpu':
+            logging.error('Stopped %s after it used more than %s seconds of CPU time (--max-cpu)', name,
+                args._termtool_max_cpu)
+            return self.EXIT_CPU_LIMIT
+        logging.error('Stopped %s after it used more than %.1f MiB of memory (--max-rss)', name,
+            args._termtool_max_rss / 1048576.0)
+        return self.EXIT_MEMORY_LIMIT
+
+    def _discard_output(self):
+        """Throw away any further output after standard output is closed by
+        its reader, so writing it when Python exits can't fail again."""
+        if getattr(self, '_emitted', None):
+            del self._emitted[:]
+        try:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            os.close(devnull)
+        except (AttributeError, ValueError, OSError):
+            pass
+
+    def _time_phase(self, phase, fn, *args):
+        """Call `fn` with `args`, recording how long it took as the step
+        `phase` in the instance's `timings`."""
+        start_wall, start_cpu = _wall_clock(), _cpu_clock()
+        try:
+            return fn(*args)
+        finally:
+            self.timings[phase] = (_wall_clock() - start_wall, _cpu_clock() - start_cpu, _peak_rss())
+
+    def _report_timings(self):
+        """Write the instance's `timings` to stderr as a table."""
+        table = _TinyTable(['phase', 'wall (ms)', 'cpu (ms)', 'peak rss (MiB)'])
+        for phase, (wall, cpu, peak_rss) in self.timings.items():
+            table.add_row([phase, '%.2f' % (wall * 1000), '%.2f' % (cpu * 1000),
+                '%.1f' % (peak_rss / 1048576.0) if peak_rss is not None else '-'])
+        sys.stderr.write('%s\n' % table)
+
+    def _profile_subcommand(self, run, args, profile_file=None):
+        """Perform the subcommand parsed into `args` with `run` under `cProfile`.
+
+        The profile is saved to the file `profile_file` for `pstats`, or if
+        there's no `profile_file`, the `profile_limit` functions with the most
+        cumulative time are printed to stderr.
+
+        """
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run, args)
+        finally:
+            if profile_file is not None:
+                profiler.dump_stats(profile_file)
+                logging.info('Wrote profile to %s', profile_file)
+            else:
+                stats = pstats.Stats(profiler, stream=sys.stderr)
+                stats.sort_stats('cumulative').print_stats(self.profile_limit)
+
+    def _run_subcommand(self, args):
+        """Perform the subcommand parsed into `args`, returning the exit code."""
+        ttl = _subcommand_option(args.func, 'cache_ttl')
+        # Output written by other threads would be mixed up, so only cache
+        # runs in the main thread.
+        if (ttl is not None and getattr(args, '_termtool_cache', True)
+                and threading.current_thread().name == 'MainThread'):
+            return self._run_cached_subcommand(args, ttl)
+        return self._perform_subcommand(args)
+
+    def _run_key(self, args, batch=None):
+        """Return a key identifying the run described by the parsed arguments
+        `args`, for naming its result cache and checkpoint files. For the run
+        of a whole batch, `batch` is the batch file it runs."""
+        import hashlib
+        name = self._command_names().get(args.subcommand, args.subcommand)
+        items = sorted((key, value) for key, value in vars(args).items()
+            if key not in _UNCACHED_ARGS)
+        cls = type(self)
+        key = repr((__version__, cls.__module__, cls.__name__, name, items))
+        if batch is not None:
+            key = repr((key, batch))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _run_cached_subcommand(self, args, ttl):
+        """Perform the subcommand parsed into `args`, or replay its output and
+        exit code from a run with the same arguments in the last `ttl`
+        seconds."""
+        appname = type(self).__name__.lower()
+        filepath = os.path.join(_cache_dir(), '%s.results' % appname, self._run_key(args))
+
+        if not getattr(args, '_termtool_refresh', False):
+            cached = _read_cached_result(filepath, ttl)
+            if cached is not None:
+                status, output = cached
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                return status
+
+        out = _CapturingOutput(sys.stdout, self.result_cache_size)
+        sys.stdout = out
+        try:
+            status = self._perform_subcommand(args)
+            self.flush_records()
+        finally:
+            sys.stdout = out.out
 
-        self.configure_tool(args)
+        if not out.overflowed:
+            _save_cached_result(filepath, status, out.getvalue(), self.result_cache_size)
+        return status
 
+    def _perform_subcommand(self, args):
+        """Perform the subcommand parsed into `args`, returning the exit code."""
         # The callable subcommand is parsed out as the "func" arg.
+        if _is_coroutine_function(args.func):
+            return self._run_async_subcommand(args)
+        if _subcommand_option(args.func, 'parallel') is not None:
+            return self._run_parallel_subcommand(args)
+
+        args.func(self, args)
+        return 0
+
+    def _parse_batch_line(self, parser, config_sections, args, line):
+        """Parse the command `line` of a batch into a copy of the batch's
+        arguments `args`, returning the arguments and an exit status, which
+        is ``None`` if the line parsed and can be run."""
+        import shlex
+
+        line_args = argparse.Namespace(**vars(args))
+        line_args._termtool_batch = None
+        try:
+            line_argv = self._config_arguments(parser, [], config_sections, shlex.split(line))
+            line_args = parser.parse_args(line_argv, namespace=line_args)
+        except ValueError as exc:
+            logging.error('Could not read batch command %r: %s', line, exc)
+            return None, 2
+        except SystemExit as exc:
+            # argparse already reported the bad arguments, or printed help.
+            return None, exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 2)
+
+        if getattr(line_args, 'func', None) is None:
+            logging.error('Batch command %r names no subcommand', line)
+            return None, 2
+        if line_args._termtool_batch is not None:
+            logging.error('Batch command %r cannot run another batch', line)
+            return None, 2
+        if getattr(line_args, '_termtool_resume', False) and not getattr(args, '_termtool_resume', False):
+            # The lines share the checkpoints of the batch, so only the batch
+            # as a whole can be resumed.
+            logging.error('Batch command %r cannot use --resume; give it with --batch instead', line)
+            return None, 2
+        return line_args, None
+
+    def _run_batch_command(self, args):
+        """Perform one subcommand of a batch, returning its exit status."""
+        try:
+            return self._run_subcommand(args)
+        except SystemExit as exc:
+            return exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 1)
+        except Exception as exc:
+            logging.error('%s failed: %s', args.subcommand, exc)
+            logging.debug('Traceback for %s failure:', args.subcommand, exc_info=True)
+            return 1
+
+    def _run_batch(self, parser, config_sections, args):
+        """Perform the subcommands listed one per line in the ``--batch``
+        file, writing the exit status of each line to stdout as a line of
+        JSON, and returning the number of lines that failed (up to 100).
+
+        Lines are parsed with `parser` and run in this process, without
+        configuring the tool again. With ``--jobs``, that many lines are run
+        at once.
+
+        """
+        import json
+
+        # A lazily built parser may be missing the subcommands the batch
+        # lines use.
+        if (self.lazy_arg_parser or self.plugin_group) and parser is not getattr(self, '_warm_parser', None):
+            parser = self.build_arg_parser()
+
+        def report(number, line, status):
+            self.flush_records()
+            sys.stdout.write('%s\n' % json.dumps({'line': number, 'command': line, 'status': status}))
+            sys.stdout.flush()
+            return 1 if status else 0
+
+        jobs = getattr(args, '_termtool_jobs', None)
+        executor = None
+        if jobs is not None:
+            from concurrent import futures
+            executor = futures.ThreadPoolExecutor(max_workers=jobs)
+            pending = dict()
+
+        batch_file = sys.stdin if args._termtool_batch == '-' else open(args._termtool_batch, 'r')
+        failures = 0
         try:
-            args.func(self, args)
+            # Read lines as they come, so commands can be piped in.
+            for number, line in enumerate(iter(batch_file.readline, ''), 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                line_args, status = self._parse_batch_line(parser, config_sections, args, line)
+                if status is not None:
+                    failures += report(number, line, status)
+                elif executor is None:
+                    failures += report(number, line, self._run_batch_command(line_args))
+                else:
+                    job = executor.submit(self._run_batch_command, line_args)
+                    pending[job] = (number, line)
+
+            if executor is not None:
+                for job in futures.as_completed(pending):
+                    number, line = pending[job]
+                    failures += report(number, line, job.result())
         except KeyboardInterrupt:
+            if executor is not None:
+                _stop_executor(executor, pending)
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            if batch_file is not sys.stdin:
+                batch_file.close()
+
+        return min(failures, 100)
+
+    def _parallel_args(self, args):
+        """Return a list of the values of the `parallel` subcommand parsed
+        into `args`, each paired with a copy of `args` for only that value."""
+        dest = _subcommand_option(args.func, 'parallel')
+        items = getattr(args, dest)
+        if not isinstance(items, (list, tuple)):
+            items = [] if items is None else [items]
+
+        item_args_list = list()
+        for item in items:
+            item_args = argparse.Namespace(**vars(args))
+            setattr(item_args, dest, item)
+            item_args_list.append((item, item_args))
+        return item_args_list
+
+    def _finish_parallel_job(self, args, item, job):
+        """Handle the result of a finished `parallel` subcommand job for
+        value `item`, returning ``1`` if it failed or ``0`` if not."""
+        try:
+            result = job.result()
+        except Exception as exc:
+            logging.error('%s failed for %s: %s', args.subcommand, item, exc)
+            logging.debug('Traceback for %s failure:', item, exc_info=True)
             return 1
+        self.handle_parallel_result(args, item, result)
+        return 0
+
+    def _run_parallel_subcommand(self, args):
+        """Perform a `parallel` subcommand once for each of its values in a
+        worker pool, returning the number of values that failed as the exit
+        code (up to 100)."""
+        from concurrent import futures
+
+        command = args.func
+        if _subcommand_option(command, 'pool') == 'process':
+            executor = futures.ProcessPoolExecutor(max_workers=getattr(args, '_termtool_jobs', None))
+        else:
+            executor = futures.ThreadPoolExecutor(max_workers=getattr(args, '_termtool_jobs', None))
+
+        jobs = list()
+        failures = 0
+        try:
+            item_for_job = dict()
+            for item, item_args in self._parallel_args(args):
+                job = executor.submit(_call_subcommand, self, command, item_args)
+                jobs.append(job)
+                item_for_job[job] = item
+
+            if _subcommand_option(command, 'ordered'):
+                finished = jobs
+            else:
+                finished = futures.as_completed(jobs)
+            for job in finished:
+                failures += self._finish_parallel_job(args, item_for_job[job], job)
+        except (KeyboardInterrupt, _LimitExceeded):
+            # Drop the work that hasn't started yet.
+            _stop_executor(executor, jobs)
+            raise
+
+        executor.shutdown()
+        return min(failures, 100)
+
+    def _run_async_subcommand(self, args):
+        """Perform an ``async def`` subcommand in a new event loop, returning
+        the exit code.
+
+        The loop is a `uvloop` loop if that's installed. The tool's
+        `semaphore` attribute is set to an `asyncio.Semaphore` sized by the
+        ``--concurrency`` option for the subcommand to share. `parallel`
+        subcommands are run as one task per value, all in the same loop.
+
+        """
+        import asyncio
+        try:
+            import uvloop
+        except ImportError:
+            loop = asyncio.new_event_loop()
+        else:
+            loop = uvloop.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        command = args.func
+        self.semaphore = asyncio.Semaphore(getattr(args, '_termtool_concurrency', None) or 100)
+        try:
+            if _subcommand_option(command, 'parallel') is None:
+                loop.run_until_complete(command(self, args))
+                return 0
+
+            tasks = list()
+            item_for_task = dict()
+            for item, item_args in self._parallel_args(args):
+                task = loop.create_task(command(self, item_args))
+                tasks.append(task)
+                item_for_task[task] = item
+
+            failures = 0
+            if _subcommand_option(command, 'ordered'):
+                for task in tasks:
+                    loop.run_until_complete(asyncio.wait([task]))
+                    failures += self._finish_parallel_job(args, item_for_task[task], task)
+            else:
+                pending = set(tasks)
+                while pending:
+                    done, pending = loop.run_until_complete(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+                    for task in done:
+                        failures += self._finish_parallel_job(args, item_for_task[task], task)
+            return min(failures, 100)
+        except KeyboardInterrupt:
+            # Let the tasks clean up after themselves before giving up.
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            raise
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def handle_parallel_result(self, args, item, result):
+        """Handle the return value `result` of a `parallel` subcommand for
+        one of its values, `item`.
+
+        This method is called in the main thread, in the order of the values
+        or as each is completed, according to the subcommand's `ordered`
+        setting. This implementation prints `result` unless it's ``None``.
+
+        """
+        if result is not None:
+            print(result)
+
+    def serve(self, socket_path=None):
+        """Serve runs of the tool to clients connecting to a Unix socket,
+        so they don't pay for starting Python and building the parser.
+
+        The argument parser is built once up front. For each client, the
+        server forks a worker that takes on the client's standard input,
+        output and error, environment and working directory, runs `main()`
+        with the client's arguments, and sends back the exit code.
+
+        The socket is at `socket_path`, or by default at
+        ``$XDG_RUNTIME_DIR/termtool/toolname.sock`` (or in
+        ``/tmp/termtool-UID`` if there's no ``$XDG_RUNTIME_DIR``). Like the
+        config file, it's accessible only by the user running the server.
+        Use `connect()` (or ``python -m termtool toolname ...``) as the
+        client. The server runs until interrupted.
 
+        """
+        import socket
+
+        appname = type(self).__name__.lower()
+        if socket_path is None:
+            socket_path = _server_socket_path(appname)
+        socket_dir = os.path.dirname(socket_path)
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        self._warm_parser = self.build_arg_parser()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Don't let anybody else connect to the socket.
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(socket_path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(socket_path, 0o600)
+        server.listen(64)
+        # Logging isn't configured until a worker runs the tool, so don't
+        # let this configure it with logging.basicConfig().
+        logging.getLogger('termtool').info('Serving %s on %s', appname, socket_path)
+
+        workers = set()
+        try:
+            while True:
+                conn, _ = server.accept()
+                # Read the config files here, so workers start with them
+                # already parsed, and only read files that changed since.
+                try:
+                    self.read_config()
+                except Exception:
+                    pass
+                # Flush before forking so the worker doesn't repeat output.
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    os._exit(self._serve_client(conn))
+                conn.close()
+                workers.add(pid)
+
+                # Reap any workers that have finished.
+                for worker in list(workers):
+                    if os.waitpid(worker, os.WNOHANG)[0]:
+                        workers.discard(worker)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(socket_path)
+
+    def _serve_client(self, conn):
+        """Perform one client's run of the tool in a forked worker,
+        returning the worker process's exit code."""
+        import json
+        import socket
+        import struct
+
+        try:
+            if hasattr(socket, 'SO_PEERCRED'):
+                creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+                _, uid, _ = struct.unpack('3i', creds)
+                if uid != os.getuid():
+                    return 1
+
+            message, fds = _receive_message(conn, 3)
+            request = json.loads(message)
+            conn.sendall(struct.pack('!i', os.getpid()))
+
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            os.environ.clear()
+            os.environ.update(request['env'])
+            os.chdir(request['cwd'])
+
+            try:
+                exit_code = self.main(request['argv'])
+            except SystemExit as exc:
+                exit_code = exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 1)
+            except Exception:
+                logging.exception('Uncaught exception')
+                exit_code = 1
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(struct.pack('!i', exit_code or 0))
+        except Exception:
+            return 1
+        finally:
+            conn.close()
         return 0
 
-    def run(self):
+    COMPLETION_SHELLS = ('bash', 'zsh', 'fish')
+    """The shells `completion_script()` can write completion scripts for."""
+
+    def _completion(self):
+        """Describe the tool's global options and subcommands for shell
+        completion."""
+        spec = self._parser_spec()
+        global_parser = self._build_global_parser(spec)
+        self._add_run_options(global_parser)
+        global_options, _ = _completion_actions(global_parser)
+        global_options.insert(0, {'strings': ['-h', '--help'], 'value': False, 'optional': False,
+            'choices': None, 'dest': 'help', 'help': 'show this help message and exit'})
+        commands = list()
+        for command_spec in spec['subcommands']:
+            parser = argparse.ArgumentParser(add_help=False)
+            for arg_args, arg_kwargs in command_spec['arguments']:
+                parser.add_argument(*arg_args, **arg_kwargs)
+            self._add_subcommand_run_options(parser, command_spec.get('options', ()))
+            options, positionals = _completion_actions(parser)
+            kwargs = command_spec['kwargs']
+            commands.append({
+                'names': [command_spec['name']] + list(kwargs.get('aliases', ())),
+                'help': kwargs.get('help') or '',
+                'options': options,
+                'positionals': positionals,
+            })
+        # Plugins are completed by name only, so writing the script doesn't
+        # import them.
+        for plugin in self._plugin_manifest():
+            commands.append({
+                'names': [plugin['name']] + list(plugin['kwargs'].get('aliases', ())),
+                'help': plugin['kwargs'].get('help') or '',
+                'options': [],
+                'positionals': [],
+            })
+        commands.sort(key=lambda command: command['names'][0])
+        return {'options': global_options, 'commands': commands}
+
+    def completion_script(self, shell, prog=None):
+        """Return a script that sets up tab completion of the tool's
+        subcommands and options in `shell`, one of ``bash``, ``zsh`` or
+        ``fish``.
+
+        The script completes the command `prog`, by default the name of the
+        running script. Completing uses only the shell's builtin commands, so
+        the tool itself isn't run when the user presses TAB. Values of options
+        and arguments without choices are completed from the values saved
+        with `update_completions()`.
+
+        """
+        if shell not in self.COMPLETION_SHELLS:
+            raise ValueError('Unknown shell %r for completion (choose from %s)'
+                % (shell, ', '.join(self.COMPLETION_SHELLS)))
+        if prog is None:
+            prog = os.path.basename(sys.argv[0])
+        appname = type(self).__name__.lower()
+        completion = self._completion()
+
+        if shell == 'fish':
+            return _fish_completion_script(prog, appname, completion)
+        script = _bash_completion_script(prog, appname, completion)
+        if shell == 'zsh':
+            script = 'autoload -U +X bashcompinit && bashcompinit\n' + script
+        return script
+
+    def update_completions(self, dest, values):
+        """Save the `values` to complete for arguments with the destination
+        `dest` in the tool's completion scripts.
+
+        Call this from a subcommand that finds out the possible values, such
+        as one that lists hosts or IDs, so that pressing TAB can offer them
+        without running the tool. The values are saved one per line in the
+        tool's directory in the user's cache directory, replacing any values
+        saved before.
+
+        """
+        appname = type(self).__name__.lower()
+        filepath = os.path.join(_cache_dir(), '%s.completions' % appname, dest)
+        _write_file_atomically(filepath, ''.join('%s\n' % value for value in values))
+
+    def run(self, server=False):
         """Invoke the terminal command for usage at the command line.
 
         This method invokes the instance's `main()` method, passing the command
         line arguments specified in `sys.argv`, and terminating the process
         using `sys.exit()` with the exit code returned by `main()`.
 
+        If `server` is true or the only command line argument is ``--serve``,
+        the tool instead serves runs to clients with `serve()`. If the only
+        arguments are ``--completion`` and a shell name, the tool prints its
+        `completion_script()` for that shell.
+
+        If the run was stopped for exceeding one of its resource limits, the
+        process exits right away, without waiting for any threads still
+        working on the stopped subcommand.
+
         """
-        sys.exit(self.main(sys.argv[1:]))
+        if server or sys.argv[1:] == ['--serve']:
+            self.serve()
+            sys.exit(0)
+        if len(sys.argv) == 3 and sys.argv[1] == '--completion':
+            try:
+                sys.stdout.write(self.completion_script(sys.argv[2]))
+            except ValueError as exc:
+                sys.stderr.write('%s\n' % exc)
+                sys.exit(2)
+            sys.exit(0)
+        status = self.main(sys.argv[1:])
+        if getattr(self, '_limit_exceeded', None):
+            # Threads still working for the stopped subcommand would keep
+            # the process from exiting, so don't wait for them.
+            logging.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+        sys.exit(status)
+
+
+def _server_socket_path(appname):
+    """Return the default path of the socket for serving the tool `appname`."""
+    # The client computes the same path without importing termtool.
+    import termtool_client
+    return termtool_client.socket_path(appname)
+
+
+def _receive_message(conn, num_fds):
+    """Receive a length prefixed message and up to `num_fds` file
+    descriptors from the socket `conn`."""
+    import array
+    import socket
+    import struct
+
+    fds = array.array('i')
+    data, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_LEN(num_fds * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    if len(data) < 4:
+        raise IOError('truncated message from client')
+
+    size, = struct.unpack('!I', data[:4])
+    data = data[4:]
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise IOError('truncated message from client')
+        data += chunk
+    return data.decode('utf-8'), list(fds)
+
+
+def connect(appname, argv=None, socket_path=None):
+    """Run the tool `appname` through its server, returning the exit code.
+
+    The server is a tool started with `Termtool.serve()`. The arguments
+    `argv` (by default, the current process's command line arguments), the
+    environment and the working directory are sent to the server, which
+    runs the tool with this process's standard input, output and error.
+    Pressing ctrl-C interrupts the run in the server.
+
+    This is `termtool_client.connect()`, which scripts run often should use
+    directly so they don't pay to import termtool.
+
+    """
+    import termtool_client
+    return termtool_client.connect(appname, argv, socket_path)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write('usage: python -m termtool_client TOOLNAME [ARGUMENT ...]\n')
+        sys.exit(2)
+    sys.exit(connect(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,88 @@
+"""Run a tool through its `termtool` server.
+
+This module is the client for tools started with `Termtool.serve()`. It
+imports only what it needs to talk to the server, so running a tool with::
+
+    $ python -m termtool_client toolname [arguments...]
+
+costs little more than starting Python itself.
+
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+
+
+def socket_path(appname):
+    """Return the default path of the socket for serving the tool `appname`."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        socket_dir = os.path.join(runtime_dir, 'termtool')
+    else:
+        socket_dir = os.path.join(_temp_dir(), 'termtool-%d' % os.getuid())
+    return os.path.join(socket_dir, '%s.sock' % appname)
+
+
+def _temp_dir():
+    # Like tempfile.gettempdir(), without importing tempfile.
+    for name in ('TMPDIR', 'TEMP', 'TMP'):
+        dirpath = os.environ.get(name)
+        if dirpath and os.path.isdir(dirpath):
+            return os.path.abspath(dirpath)
+    return '/tmp'
+
+
+def _receive_int(conn):
+    data = b''
+    while len(data) < 4:
+        chunk = conn.recv(4 - len(data))
+        if not chunk:
+            raise IOError('server closed the connection')
+        data += chunk
+    return struct.unpack('!i', data)[0]
+
+
+def connect(appname, argv=None, path=None):
+    """Run the tool `appname` through its server, returning the exit code.
+
+    The server is a tool started with `Termtool.serve()`. The arguments
+    `argv` (by default, the current process's command line arguments), the
+    environment and the working directory are sent to the server, which
+    runs the tool with this process's standard input, output and error.
+    Pressing ctrl-C interrupts the run in the server.
+
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if path is None:
+        path = socket_path(appname)
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(path)
+    try:
+        message = json.dumps({'argv': list(argv), 'env': dict(os.environ), 'cwd': os.getcwd()}).encode('utf-8')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendmsg([struct.pack('!I', len(message)) + message],
+            [(socket.SOL_SOCKET, socket.SCM_RIGHTS, struct.pack('3i', 0, 1, 2))])
+
+        worker = _receive_int(conn)
+        while True:
+            try:
+                return _receive_int(conn)
+            except KeyboardInterrupt:
+                # Interrupt the run, then wait to hear how it ended.
+                import signal
+                os.kill(worker, signal.SIGINT)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write('usage: python -m termtool_client TOOLNAME [ARGUMENT ...]\n')
+        sys.exit(2)
+    sys.exit(connect(sys.argv[1], sys.argv[2:]))
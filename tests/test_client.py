@@ -0,0 +1,84 @@
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CLIENT_FORBIDDEN_MODULES = ('termtool', 'argparse', 'logging', 'threading', 'tempfile')
+"""Modules that the client should not import, so it starts quickly."""
+
+ECHO_TOOL = '''
+from termtool import Termtool, subcommand, argument
+
+
+class Echo(Termtool):
+
+    @subcommand(help='prints its words')
+    @argument('words', nargs='*')
+    def say(self, args):
+        print(' '.join(args.words))
+
+    @subcommand(help='fails')
+    def fail(self, args):
+        raise ValueError('failed')
+
+
+if __name__ == '__main__':
+    Echo().serve(%r)
+'''
+
+
+def python_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SOURCE_DIR, env.get('PYTHONPATH')]))
+    return env
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tempdir, 'echo.sock')
+        script = os.path.join(self.tempdir, 'echo.py')
+        with open(script, 'w') as f:
+            f.write(ECHO_TOOL % self.socket_path)
+        self.server = subprocess.Popen([sys.executable, script], env=python_env())
+        deadline = time.time() + 10
+        while not os.path.exists(self.socket_path):
+            self.assertIsNone(self.server.poll())
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.wait()
+        shutil.rmtree(self.tempdir)
+
+    def run_client(self, *args):
+        code = ('import sys, termtool_client; status = termtool_client.connect("echo", sys.argv[1:], %r); '
+            'sys.stderr.write(" ".join(sys.modules)); sys.exit(status)' % self.socket_path)
+        proc = subprocess.Popen([sys.executable, '-c', code] + list(args), stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, env=python_env(), universal_newlines=True)
+        output, errors = proc.communicate()
+        modules = set(errors.split())
+        return proc.returncode, output, modules
+
+    def test_run(self):
+        status, output, modules = self.run_client('say', 'hello', 'world')
+        self.assertEqual(status, 0)
+        self.assertEqual(output, 'hello world\n')
+        self.assertEqual(sorted(modules.intersection(CLIENT_FORBIDDEN_MODULES)), [])
+
+    def test_failed_run(self):
+        status, _, _ = self.run_client('fail')
+        self.assertEqual(status, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import os.path
+import subprocess
+import sys
+import unittest
+
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+DEFERRED_MODULES = ('prettytable', 'progressbar', 'asyncio', 'concurrent.futures', 'json', 'socket',
+    'tempfile', 'cProfile')
+"""Modules that importing termtool should not import, as only some tools or
+runs use them."""
+
+IMPORT_BUDGET_MS = 250.0
+"""The most milliseconds ``import termtool`` may take, generous enough for
+slow machines and for compiling the module without cached bytecode."""
+
+
+def run_python(*args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SOURCE_DIR, env.get('PYTHONPATH')]))
+    proc = subprocess.Popen((sys.executable,) + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        env=env, universal_newlines=True)
+    output, errors = proc.communicate()
+    if proc.returncode != 0:
+        raise AssertionError('python %s failed:\n%s' % (' '.join(args), errors))
+    return output, errors
+
+
+class TestImport(unittest.TestCase):
+
+    def test_deferred_modules(self):
+        output, _ = run_python('-c', 'import sys, termtool; print(" ".join(sys.modules))')
+        imported = set(output.split())
+        self.assertEqual(sorted(imported.intersection(DEFERRED_MODULES)), [])
+
+    def test_import_time(self):
+        timings = list()
+        for _ in range(3):
+            _, errors = run_python('-X', 'importtime', '-c', 'import termtool')
+            for line in errors.splitlines():
+                if line.startswith('import time:') and line.rstrip().endswith('| termtool'):
+                    timings.append(int(line.split('|')[1]) / 1000.0)
+        self.assertEqual(len(timings), 3)
+        self.assertLess(min(timings), IMPORT_BUDGET_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os.path
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from termtool import Termtool, subcommand, argument
+
+
+class Counter(Termtool):
+
+    @subcommand(help='counts things')
+    @argument('--fail', action='store_true')
+    def count(self, args):
+        self.metrics.increment('things', 3)
+        self.metrics.gauge('queue', 7)
+        if args.fail:
+            raise ValueError('failed to count')
+
+
+class TestStatsdSink(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.settimeout(5)
+
+    def tearDown(self):
+        self.listener.close()
+
+    def received_lines(self):
+        lines = list()
+        while not any(line.startswith('termtool.counter.count.runs:') for line in lines):
+            packet, _ = self.listener.recvfrom(65536)
+            lines.extend(packet.decode('utf-8').split('\n'))
+        return lines
+
+    def test_statsd(self):
+        sink = 'statsd://127.0.0.1:%d' % self.listener.getsockname()[1]
+        with self.assertRaises(ValueError):
+            Counter().main(['--metrics', sink, 'count', '--fail'])
+
+        lines = self.received_lines()
+        self.assertIn('termtool.counter.count.runs:1|c', lines)
+        self.assertIn('termtool.counter.count.failures:1|c', lines)
+        self.assertIn('termtool.counter.count.exit_code:1|g', lines)
+        self.assertIn('termtool.counter.count.things:3|c', lines)
+        self.assertIn('termtool.counter.count.queue:7|g', lines)
+        self.assertTrue(any(line.startswith('termtool.counter.count.duration:') and line.endswith('|ms')
+            for line in lines))
+
+
+class TestPrometheusSink(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read_samples(self, filepath):
+        samples = dict()
+        with open(filepath) as prom_file:
+            for line in prom_file:
+                if line.startswith('#') or not line.strip():
+                    continue
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_runs_are_merged(self):
+        sink = 'prometheus:' + self.tempdir
+        self.assertEqual(Counter().main(['--metrics', sink, 'count']), 0)
+        with self.assertRaises(ValueError):
+            Counter().main(['--metrics', sink, 'count', '--fail'])
+
+        samples = self.read_samples(os.path.join(self.tempdir, 'counter.prom'))
+        labels = '{subcommand="count",tool="counter"}'
+        self.assertEqual(samples['termtool_runs_total' + labels], 2)
+        self.assertEqual(samples['termtool_run_failures_total' + labels], 1)
+        self.assertEqual(samples['termtool_last_run_exit_code' + labels], 1)
+        self.assertEqual(samples['termtool_last_run_counter{counter="things",subcommand="count",tool="counter"}'], 3)
+        self.assertEqual(samples['termtool_last_run_gauge{gauge="queue",subcommand="count",tool="counter"}'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from termtool import Termtool, subcommand, argument
+
+
+class Shouter(Termtool):
+
+    @subcommand(help='shouts the names', parallel='names', pool='process', ordered=True)
+    @argument('names', nargs='+')
+    def shout(self, args):
+        self.metrics.increment('shouts')
+        return args.names.upper()
+
+
+class TestProcessPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tempdir)
+
+    def run_tool(self, *argv):
+        status = Shouter().main(list(argv))
+        return status, sys.stdout.getvalue().split()
+
+    def test_process_pool(self):
+        status, lines = self.run_tool('--jobs', '2', 'shout', 'ann', 'bob', 'cal')
+        self.assertEqual(status, 0)
+        self.assertEqual(lines, ['ANN', 'BOB', 'CAL'])
+
+    def test_process_pool_with_metrics(self):
+        filepath = os.path.join(self.tempdir, 'metrics.jsonl')
+        status, lines = self.run_tool('--metrics', 'jsonl:' + filepath, '--jobs', '2', 'shout', 'ann', 'bob')
+        self.assertEqual(status, 0)
+        self.assertEqual(lines, ['ANN', 'BOB'])
+
+        with open(filepath) as metrics_file:
+            records = [json.loads(line) for line in metrics_file]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['subcommand'], 'shout')
+        self.assertEqual(records[0]['exit_code'], 0)
+
+    def test_process_pool_with_async_logging(self):
+        status, lines = self.run_tool('--log-async', '--jobs', '2', 'shout', 'ann', 'bob')
+        self.assertEqual(status, 0)
+        self.assertEqual(lines, ['ANN', 'BOB'])
+
+
+if __name__ == '__main__':
+    unittest.main()